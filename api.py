@@ -0,0 +1,310 @@
+import startup  # First import: start-up timings are measured from here
+import argparse
+import base64
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlparse
+
+from metrics import TOTALS
+from scanner import IMAGE_EXTENSIONS
+
+# Local classification API: concurrent requests are grouped into batches per model.
+#   curl --data-binary @photo.jpg "http://127.0.0.1:8765/classify?model=default"
+#   curl -d '{"model": "default", "paths": ["D:/Inbox/a.jpg"]}' http://127.0.0.1:8765/classify
+
+MAX_BODY = 64 * 2**20
+
+
+class Overloaded(Exception):
+    """The request queue of a model is full."""
+
+
+class UnknownModel(Exception):
+    """The requested model could not be loaded."""
+
+
+class MicroBatcher:
+    """
+    Groups concurrent classification requests for one ImageSorter into batches: a batch runs
+    as soon as it holds `max_batch` images or its oldest image has waited `max_wait` seconds.
+    Batches run one at a time on a single thread; at most `max_queue` images wait, so
+    latency stays bounded under overload (submit raises Overloaded instead).
+    """
+    def __init__(self, sorter, max_batch=16, max_wait=0.005, max_queue=1024):
+        self.sorter = sorter
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"batcher-{sorter.model_name}")
+        self._thread.start()
+
+    def submit(self, image):
+        """Queues a decoded image, returns a Future of its {'label', 'score', 'scores'} result."""
+        future = Future()
+        try:
+            self._queue.put_nowait((image, future, time.perf_counter()))
+        except queue.Full:
+            raise Overloaded(f"{self.sorter.model_name}: {self._queue.maxsize} images already waiting")
+        TOTALS.gauge('api_queue', self._queue.qsize())
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, stop = [item], False
+            deadline = item[2] + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._infer(batch)
+            if stop:
+                break
+        # Closed: still answer the images queued meanwhile
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.max_batch):
+            self._infer(leftover[i:i + self.max_batch])
+
+    def _infer(self, batch):
+        images = [image for image, _, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = self.sorter._predict(images)
+        except Exception as e:
+            # One bad image fails the whole batch, retry one by one to isolate it
+            print(f"API batch failed ({e}), retrying image by image")
+            results = []
+            for image in images:
+                try:
+                    results.append(self.sorter._predict([image])[0])
+                except Exception as e:
+                    results.append(e)
+        TOTALS.observe('api_batch', time.perf_counter() - start, len(batch))
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self, wait=True):
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+
+class ClassificationService:
+    """
+    Classifies images given as paths or bytes with the sorters returned by get_sorter(model)
+    (e.g. ModelRegistry.get), one MicroBatcher per model. Paths use the classification cache.
+    Images are decoded in the calling (request) threads, only inference is batched.
+    """
+    def __init__(self, get_sorter, max_batch=16, max_wait=0.005, max_queue=1024, timeout=60):
+        self.get_sorter = get_sorter
+        self.options = {'max_batch': max_batch, 'max_wait': max_wait, 'max_queue': max_queue}
+        self.timeout = timeout
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def _batcher(self, model):
+        sorter = self.get_sorter(model)
+        if not sorter.ready:
+            raise UnknownModel(model)
+        with self._lock:
+            batcher = self._batchers.get(model)
+            # A reloaded model (retrained, evicted) gets a new batcher
+            if batcher is None or batcher.sorter is not sorter:
+                if batcher is not None:
+                    batcher.close(wait=False)
+                batcher = self._batchers[model] = MicroBatcher(sorter, **self.options)
+        return batcher
+
+    def classify(self, model, paths=(), images=()):
+        """Results of paths then images (bytes), in order: result dicts, {'error': ...} for unreadable images."""
+        from imaging import load_reduced
+        batcher = self._batcher(model)
+        sorter = batcher.sorter
+        results = [None] * (len(paths) + len(images))
+        futures = {}
+        for i, path in enumerate(paths):
+            cached = sorter.cache.get(path, sorter.model_name, sorter.model_version) if sorter.cache else None
+            if cached:
+                results[i] = cached
+                continue
+            image = sorter._load_image(path)
+            if image is None:
+                results[i] = {'error': f"can't read {path}"}
+            else:
+                futures[i] = batcher.submit(image)
+        for j, data in enumerate(images, start=len(paths)):
+            try:
+                image = load_reduced(io.BytesIO(data), sorter.decode_size)
+            except Exception as e:
+                results[j] = {'error': f"can't decode image: {e}"}
+                continue
+            futures[j] = batcher.submit(image)
+        for i, future in futures.items():
+            try:
+                results[i] = future.result(timeout=self.timeout)
+            except Exception as e:
+                results[i] = {'error': str(e)}
+                continue
+            if i < len(paths) and sorter.cache:
+                sorter.cache.put(paths[i], sorter.model_name, sorter.model_version, results[i])
+        for i, path in enumerate(paths):
+            results[i] = dict(results[i], path=path)
+        return results
+
+    def close(self):
+        with self._lock:
+            for batcher in self._batchers.values():
+                batcher.close()
+            self._batchers.clear()
+
+
+def make_handler(service, default_model="default", models=None):
+    """
+    Request handler of the API. Only "default", default_model and the names returned by
+    models() (e.g. ModelRegistry.available_models) can be requested, other names get a 400.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    def check_model(model):
+        if not isinstance(model, str) or model not in {"default", default_model, *(models() if models else ())}:
+            raise ValueError(f"unknown model {model!r}")
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._reply(200, {'status': 'ok'})
+            elif path == "/stats":
+                report = TOTALS.report()
+                self._reply(200, {'stages': {k: v for k, v in report['stages'].items() if k.startswith('api_')},
+                                  'queue_peaks': report['queue_peaks']})
+            else:
+                self._reply(404, {'error': "unknown endpoint"})
+
+        def do_POST(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            if url.path != "/classify":
+                self._reply(404, {'error': "unknown endpoint"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY:
+                self._reply(413, {'error': f"body above {MAX_BODY} bytes"})
+                return
+            body = self.rfile.read(length)
+            model = parse_qs(url.query).get("model", [default_model])[0]
+            single = not self.headers.get("Content-Type", "").startswith("application/json")
+            try:
+                if single:
+                    # Raw image bytes
+                    paths, images = [], [body]
+                else:
+                    request = json.loads(body or b"{}")
+                    if not isinstance(request, dict):
+                        raise ValueError("JSON body must be an object")
+                    model = request.get("model", model)
+                    paths = request.get("paths", [])
+                    images = request.get("images", [])
+                    if not isinstance(paths, list) or not isinstance(images, list):
+                        raise ValueError("paths and images must be lists")
+                    images = [base64.b64decode(data) for data in images]
+                    if not all(isinstance(p, str) and p.lower().endswith(IMAGE_EXTENSIONS) for p in paths):
+                        raise ValueError(f"paths must be image files ({', '.join(IMAGE_EXTENSIONS)})")
+                check_model(model)
+                results = service.classify(model, paths, images)
+            except (ValueError, TypeError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            except UnknownModel:
+                self._reply(404, {'error': f"model {model} could not be loaded"})
+                return
+            except Overloaded as e:
+                self._reply(503, {'error': str(e)})
+                return
+            except Exception as e:
+                print(f"API error: {e}")
+                self._reply(500, {'error': str(e)})
+                return
+            TOTALS.observe('api_request', time.perf_counter() - start, len(results))
+            if single:
+                self._reply(422 if 'error' in results[0] else 200, dict(results[0], model=model))
+            else:
+                self._reply(200, {'model': model, 'results': results})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(get_sorter, port=8765, host="127.0.0.1", default_model="default", models=None, **options):
+    """
+    Serves the API from a daemon thread. models: callable listing the models that can be
+    requested besides the default one (see make_handler). options: max_batch, max_wait, max_queue.
+    Returns the server.
+    """
+    from http.server import ThreadingHTTPServer
+    service = ClassificationService(get_sorter, **options)
+    server = ThreadingHTTPServer((host, int(port)), make_handler(service, default_model, models))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="api").start()
+    print(f"Classification API: http://{host}:{port}/classify")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TriVision local classification API")
+    parser.add_argument("--model", default="default", help="Model used when a request doesn't name one (loaded at start)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch", type=int, default=16, help="Images per inference batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Max time an image waits for its batch to fill")
+    parser.add_argument("--max-queue", type=int, default=1024, help="Images waiting per model before requests get 503")
+    parser.add_argument("--device", default=None, help="cpu, cuda, cuda:1... (default: auto)")
+    parser.add_argument("--backend", default='pytorch', help="Inference backend (see backends.py)")
+    parser.add_argument("--metrics-port", type=int, help="Also serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    from registry import ModelRegistry
+    from sorter import ImageSorter
+    registry = ModelRegistry(lambda name: ImageSorter(model_name=name, batch_size=args.max_batch, device=args.device, backend=args.backend))
+    registry.get(args.model)
+    if args.metrics_port:
+        import metrics
+        metrics.serve(args.metrics_port, host=args.host)
+    server = serve(registry.get, port=args.port, host=args.host, default_model=args.model, models=registry.available_models,
+                   max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000, max_queue=args.max_queue)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,24 +1,50 @@
+import startup  # First import: start-up timings are measured from here
 import gradio as gr
 import os
-from sorter import ImageSorter, train_model
-import tkinter as tk
-from tkinter import filedialog
-import pandas as pd
+import threading
+from sorter import ImageSorter, train_model, TRAINING_CANCELLED
+from registry import ModelRegistry
+from journal import SortJournal, job_key
+from jobs import JobScheduler
 
-# Global Sorter
-sorter = ImageSorter(model_name="default")
+# Inference backend (see backends.py), e.g. TRIVISION_BACKEND=onnx-int8 on CPU-only machines
+BACKEND = os.environ.get("TRIVISION_BACKEND", "pytorch")
+
+# Loaded models, kept in memory so switching back and forth is instant.
+# The default model loads in the background while the UI starts.
+def load_sorter(key, cascade=None):
+    """Registry factory, key = model name or 'fast_model>big_model' for a cascade (big_model comes loaded from the registry)."""
+    name = key.partition(">")[0]
+    return ImageSorter(model_name=name, backend=BACKEND, cascade=cascade)
+
+def sorter_dependencies(key):
+    """The big model of a cascade key is a registry entry of its own, shared with plain sorts."""
+    _, _, cascade = key.partition(">")
+    return [cascade] if cascade else []
+
+registry = ModelRegistry(load_sorter, max_models=3, dependencies=sorter_dependencies)
+registry.preload("default")
+
+# Every sort / training goes through this queue: TRIVISION_MAX_JOBS sorts at once
+# (a training takes all the slots). Jobs on an already loaded model are started first.
+scheduler = JobScheduler(slots=int(os.environ.get("TRIVISION_MAX_JOBS", 2)), is_loaded=registry.is_loaded)
+
+def real_model_name(model_name):
+    return "default" if "default" in model_name else model_name
+
+NO_CASCADE = "Aucune"
+
+def sorter_key(model_name, cascade_model=NO_CASCADE):
+    if not cascade_model or cascade_model == NO_CASCADE:
+        return real_model_name(model_name)
+    return f"{real_model_name(model_name)}>{real_model_name(cascade_model)}"
 
 def get_available_models():
-    models_dir = os.path.join(os.getcwd(), "Models")
-    if not os.path.exists(models_dir):
-        os.makedirs(models_dir)
-    models = ["default (Manga/Real)"]
-    for d in os.listdir(models_dir):
-        if os.path.isdir(os.path.join(models_dir, d)):
-            models.append(d)
-    return models
+    return ["default (Manga/Real)"] + registry.available_models()
 
 def open_folder_dialog():
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     root.attributes('-topmost', True)
@@ -26,23 +52,158 @@ def open_folder_dialog():
     root.destroy()
     return folder_path
 
+def on_page_load():
+    startup.mark("ui_loaded")
+
 def update_model_dropdown():
-    return gr.Dropdown(choices=get_available_models())
+    return gr.Dropdown(choices=get_available_models()), gr.Dropdown(choices=[NO_CASCADE] + get_available_models())
 
 def on_model_change(model_name):
-    global sorter
-    real_name = "default" if "default" in model_name else model_name
-    sorter = ImageSorter(model_name=real_name)
-    return f"Modèle chargé : {real_name}"
+    real_name = real_model_name(model_name)
+    if registry.is_loaded(real_name):
+        return f"Modèle chargé : {real_name}"
+    registry.preload(real_name)
+    return f"Chargement du modèle en arrière-plan : {real_name}"
+
+COPY_METHODS = {
+    "Copie classique": 'copy',
+    "Lien physique (hardlink)": 'hardlink',
+    "Reflink (copie CoW)": 'reflink',
+}
+
+DEDUP_CHOICES = {
+    "Traiter chaque image": None,
+    "Classer une fois, copier les doublons": 'reuse',
+    "Ignorer les doublons": 'skip',
+    "Doublons en liens physiques": 'link',
+}
+
+def sort_job_params(folder, manga_out, photo_out, model_name, mode, recursive):
+    """Identifies a sort job for its journal (resume / undo)."""
+    return dict(sources=[os.path.abspath(folder)], model=real_model_name(model_name), mode=mode,
+                manga_out=manga_out or None, photo_out=photo_out or None, recursive=bool(recursive))
+
+def sort_job_key(params, **options):
+    """Job queue key: the journal identity plus every option that changes the result, so only identical sorts are shared."""
+    return (job_key(**params), tuple(sorted(options.items())))
+
+# Sort followed by each browser session, for the stop button: {'job', 'left'}
+SESSION_JOBS = {}
+_leave_lock = threading.Lock()
+
+def leave_sort(subscription):
+    """Stops following a sort job (once per subscription). The job is cancelled once nobody follows it."""
+    with _leave_lock:
+        if subscription['left']:
+            return False
+        subscription['left'] = True
+    return scheduler.release(subscription['job'].id)
+
+def format_progress(progress, total=None):
+    """Progress text of a running sort: throughput, ETA, per-label counts, last files."""
+    if not progress:
+        return "Démarrage du tri..."
+    done = progress['processed'] + progress['skipped']
+    lines = [f"⏳ {progress['processed']} images traitées ({progress['rate']:.1f} img/s, {progress['elapsed']:.0f}s)"]
+    if progress['skipped']:
+        lines[0] += f" - {progress['skipped']} déjà triées"
+    if total and progress['rate'] > 0:
+        remaining = max(0, total - done)
+        lines.append(f"Progression : {done}/{total} - reste environ {remaining / progress['rate'] / 60:.1f} min")
+    if progress['counts']:
+        lines.append(" | ".join(f"{label} : {n}" for label, n in sorted(progress['counts'].items())))
+    if progress['recent']:
+        lines += ["", "Derniers fichiers :"] + progress['recent']
+    return "\n".join(lines)
+
+def run_sort(folder, manga_out, photo_out, move_files, model_name, batch_size=8, num_workers=4, prefetch=4, copy_method="Copie classique", recursive=False, resume=True, dedup_choice="Traiter chaque image", threshold=0.0, cascade_model=NO_CASCADE, request: gr.Request = None):
+    """Generator: queues the sort and streams its progress to the UI until it finishes or is cancelled."""
+    if not folder:
+        yield "Veuillez sélectionner un dossier source."
+        return
+    mode = 'move' if move_files else COPY_METHODS.get(copy_method, 'copy')
+    params = sort_job_params(folder, manga_out, photo_out, model_name, mode, recursive)
+    total = {}
+
+    def count():
+        # Total for the ETA, counted alongside the sort (listing is much faster than classifying).
+        # Same listing as the sort: label folders inside the source are skipped, which needs the
+        # model's labels, so wait until the job has started (and loaded it)
+        while job.status == 'queued' and not job.done.wait(0.5):
+            pass
+        if job.status != 'running':
+            return
+        sorter = registry.get(job.model)
+        total['files'] = sum(1 for _ in sorter.iter_sources([folder], recursive=bool(recursive), manga_out=manga_out, photo_out=photo_out))
 
-def run_sort(folder, manga_out, photo_out, move_files, model_name):
+    def work(job):
+        # Per-job model: nothing global is switched, other jobs keep their own model
+        sorter = registry.get(job.model)
+        journal = SortJournal.for_job(resume=bool(resume), **params)
+        return sorter.sort_directory(folder, mode=mode, manga_out=manga_out, photo_out=photo_out, batch_size=int(batch_size), num_workers=int(num_workers), prefetch=int(prefetch), recursive=bool(recursive), journal=journal,
+                                     progress_callback=lambda progress: setattr(job, 'progress', progress), cancel=job.cancel,
+                                     dedup=DEDUP_CHOICES.get(dedup_choice), threshold=float(threshold) or None)
+
+    # Identical sort already queued or running: follow that job instead of a second one
+    key = sort_job_key(params, cascade=sorter_key(model_name, cascade_model), threshold=float(threshold) or None,
+                       dedup=DEDUP_CHOICES.get(dedup_choice), resume=bool(resume), batch_size=int(batch_size),
+                       num_workers=int(num_workers), prefetch=int(prefetch))
+    job = scheduler.submit('sort', sorter_key(model_name, cascade_model), work, key=key, label=os.path.basename(os.path.normpath(folder)))
+    subscription = {'job': job, 'left': False}
+    session = request.session_hash if request else None
+    SESSION_JOBS[session] = subscription
+    threading.Thread(target=count, daemon=True).start()
+    try:
+        while not job.done.wait(0.5):
+            if subscription['left'] and not job.cancel.is_set():
+                yield "Tri arrêté pour cette session, il continue pour les autres sessions qui le suivent."
+                return
+            if job.status == 'queued':
+                yield f"En file d'attente (position {scheduler.position(job)})..."
+            else:
+                yield format_progress(job.progress, total.get('files'))
+        if job.status == 'failed':
+            yield f"Erreur pendant le tri : {job.error}"
+        else:
+            yield job.result or "Tri annulé."
+    finally:
+        # Also stops the sort if the page was closed and no other session follows it
+        leave_sort(subscription)
+        if SESSION_JOBS.get(session) is subscription:
+            del SESSION_JOBS[session]
+
+def cancel_sort(request: gr.Request = None):
+    subscription = SESSION_JOBS.get(request.session_hash if request else None)
+    if subscription and not subscription['job'].done.is_set():
+        if leave_sort(subscription):
+            gr.Info("Arrêt du tri demandé, fin du lot en cours...")
+        else:
+            gr.Info("D'autres sessions suivent ce tri : il continue pour elles.")
+
+JOB_STATUS_FR = {'queued': "En attente", 'running': "En cours", 'done': "Terminé", 'failed': "Échec", 'cancelled': "Annulé"}
+JOB_KIND_FR = {'sort': "Tri", 'train': "Entraînement"}
+
+def list_jobs():
+    """Queue / running / recent jobs, newest first (also exposed as the /jobs API)."""
+    rows = []
+    for info in reversed(scheduler.list()):
+        rows.append([info['id'], JOB_KIND_FR.get(info['kind'], info['kind']), info['model'], info['label'],
+                     JOB_STATUS_FR.get(info['status'], info['status']), info['processed'] or 0,
+                     round(info['rate'] or 0.0, 1), info['error'] or ""])
+    return rows
+
+def cancel_job(job_id):
+    if job_id and scheduler.cancel(int(job_id)):
+        gr.Info(f"Tâche {int(job_id)} annulée.")
+    return list_jobs()
+
+def undo_sort(folder, manga_out, photo_out, model_name, recursive=False):
     if not folder:
         return "Veuillez sélectionner un dossier source."
-    real_name = "default" if "default" in model_name else model_name
-    if sorter.model_name != real_name:
-        on_model_change(model_name)
-    mode = 'move' if move_files else 'copy'
-    return sorter.sort_directory(folder, mode=mode, manga_out=manga_out, photo_out=photo_out)
+    journal = SortJournal.find(**sort_job_params(folder, manga_out, photo_out, model_name, 'move', recursive))
+    if not journal:
+        return "Aucun tri en mode déplacement à annuler pour ce dossier et ce modèle."
+    return f"{journal.undo()} fichiers remis à leur place."
 
 # --- NEW TRAINING LOGIC ---
 
@@ -65,7 +226,20 @@ def update_rows_visibility(num_cats):
         
     return updates
 
-def run_train_fixed_rows(epochs, batch, *args):
+TRAIN_ARCHITECTURES = {
+    "ViT-Base (précis)": 'vit-base',
+    "MobileNetV3 (rapide, 1er étage de cascade)": 'mobilenet',
+    "EfficientNet-B0 (rapide)": 'efficientnet',
+}
+
+TRAIN_PRECISION_CHOICES = {
+    "Auto (mixte sur GPU)": 'auto',
+    "FP32": 'fp32',
+    "FP16": 'fp16',
+    "BF16": 'bf16',
+}
+
+def run_train_fixed_rows(epochs, batch, preprocess_cache, loader_workers, linear_head, dedup, architecture, precision, grad_accum, freeze_layers, early_stopping, *args):
     # args: [name0, path0, name1, path1, ...]
     
     sources_list = []
@@ -85,7 +259,8 @@ def run_train_fixed_rows(epochs, batch, *args):
              class_names.append(final_name)
     
     if len(sources_list) == 0:
-        return "Erreur : Aucune catégorie valide renseignée."
+        yield "Erreur : Aucune catégorie valide renseignée."
+        return
     
     # Auto-generate Model Name
     # Limit to e.g. 50 chars to avoid filesystem issues
@@ -105,7 +280,32 @@ def run_train_fixed_rows(epochs, batch, *args):
     safe_name = re.sub(r'[^a-zA-Z0-9_]', '', raw_name)
     model_name = safe_name[:50]
     
-    return train_model(model_name, sources_list, int(epochs), int(batch))
+    def work(job):
+        result = train_model(model_name, sources_list, int(epochs), int(batch),
+                             preprocess_cache=bool(preprocess_cache), dataloader_workers=int(loader_workers),
+                             linear_head=bool(linear_head), dedup=bool(dedup),
+                             base_model=TRAIN_ARCHITECTURES.get(architecture, 'vit-base'),
+                             precision=TRAIN_PRECISION_CHOICES.get(precision, 'auto'), grad_accum=int(grad_accum),
+                             freeze_layers=int(freeze_layers), early_stopping_patience=3 if early_stopping else 0,
+                             cancel=job.cancel)
+        # A training that completed before the cancel arrived stays 'done' (its model is saved)
+        job.cancelled = result == TRAINING_CANCELLED
+        if job.cancelled:
+            return result
+        # A previous version of this model may still be loaded, alone or in a cascade
+        registry.invalidate(model_name)
+        for key in registry.loaded():
+            if model_name in key.split(">"):
+                registry.invalidate(key)
+        return result
+
+    job = scheduler.submit('train', model_name, work, key=('train', model_name))
+    while not job.done.wait(1.0):
+        if job.status == 'queued':
+            yield f"En file d'attente (position {scheduler.position(job)})..."
+        else:
+            yield f"Entraînement de '{model_name}' en cours..."
+    yield f"Echec: {job.error}" if job.status == 'failed' else (job.result or TRAINING_CANCELLED)
 
 
 # CSS
@@ -141,7 +341,7 @@ with gr.Blocks(title="TriVision AI") as demo:
                         model_selector = gr.Dropdown(label="Choisir le Modèle IA", choices=get_available_models(), value="default (Manga/Real)", interactive=True, scale=4)
                         refresh_btn = gr.Button("🔄", scale=0, min_width=40)
                 with gr.Column(scale=1):
-                    pass # Spacer
+                    cascade_selector = gr.Dropdown(label="Cascade : modèle plus gros pour les images hésitantes", choices=[NO_CASCADE] + get_available_models(), value=NO_CASCADE, interactive=True)
 
             gr.Markdown("### 2. Sélection des Dossiers")
             with gr.Group():
@@ -159,17 +359,35 @@ with gr.Blocks(title="TriVision AI") as demo:
                         btn_browse_photo = gr.Button("📂", scale=0, min_width=40)
 
             gr.Markdown("### 3. Options de Tri")
-            move_chk = gr.Checkbox(label="Déplacer les fichiers", value=False)
-            sort_btn = gr.Button("🚀 Démarrer le Tri", variant="primary", size="lg")
-            output_log = gr.Textbox(label="Logs", lines=8, interactive=False)
+            with gr.Row():
+                move_chk = gr.Checkbox(label="Déplacer les fichiers", value=False)
+                recursive_chk = gr.Checkbox(label="Inclure les sous-dossiers", value=False)
+                resume_chk = gr.Checkbox(label="Reprendre un tri interrompu", value=True)
+                copy_method = gr.Dropdown(label="Méthode de copie (si pas de déplacement)", choices=list(COPY_METHODS), value="Copie classique", interactive=True)
+                dedup_dd = gr.Dropdown(label="Doublons (identiques ou quasi identiques)", choices=list(DEDUP_CHOICES), value="Traiter chaque image", interactive=True)
+            with gr.Row():
+                threshold_sl = gr.Slider(label="Seuil de confiance : en dessous, l'image va dans _uncertain (0 = désactivé)", minimum=0.0, maximum=1.0, value=0.0, step=0.05)
+            with gr.Accordion("Performances", open=False):
+                with gr.Row():
+                    sort_batch = gr.Slider(label="Images par lot (inférence)", minimum=1, maximum=64, value=8, step=1)
+                    sort_workers = gr.Slider(label="Threads de décodage", minimum=1, maximum=32, value=min(8, os.cpu_count() or 1), step=1)
+                    sort_prefetch = gr.Slider(label="Lots préchargés", minimum=1, maximum=32, value=4, step=1)
+            with gr.Row():
+                sort_btn = gr.Button("🚀 Démarrer le Tri", variant="primary", size="lg", scale=4)
+                stop_btn = gr.Button("⏹️ Arrêter", variant="stop", size="lg", scale=1)
+                undo_btn = gr.Button("↩️ Annuler le tri (déplacement)", size="lg", scale=1)
+            output_log = gr.Textbox(label="Logs", lines=14, interactive=False)
             
             # Sub-Events
-            refresh_btn.click(fn=update_model_dropdown, outputs=model_selector)
+            refresh_btn.click(fn=update_model_dropdown, outputs=[model_selector, cascade_selector])
             model_selector.change(fn=on_model_change, inputs=model_selector, outputs=output_log)
             btn_browse_in.click(fn=open_folder_dialog, outputs=input_dir)
             btn_browse_manga.click(fn=open_folder_dialog, outputs=manga_out)
             btn_browse_photo.click(fn=open_folder_dialog, outputs=photo_out)
-            sort_btn.click(fn=run_sort, inputs=[input_dir, manga_out, photo_out, move_chk, model_selector], outputs=output_log)
+            # No Gradio-side limit: concurrency is handled by the job scheduler
+            sort_btn.click(fn=run_sort, inputs=[input_dir, manga_out, photo_out, move_chk, model_selector, sort_batch, sort_workers, sort_prefetch, copy_method, recursive_chk, resume_chk, dedup_dd, threshold_sl, cascade_selector], outputs=output_log, concurrency_limit=None)
+            stop_btn.click(fn=cancel_sort, queue=False)
+            undo_btn.click(fn=undo_sort, inputs=[input_dir, manga_out, photo_out, model_selector, recursive_chk], outputs=output_log)
 
         # --- TAB 2: TRAINING ---
         with gr.Tab("🧠 Entraînement"):
@@ -224,15 +442,53 @@ with gr.Blocks(title="TriVision AI") as demo:
             with gr.Row():
                 epochs = gr.Slider(label="Epochs", minimum=1, maximum=20, value=3, step=1)
                 batch = gr.Slider(label="Batch Size", minimum=1, maximum=32, value=4, step=1)
+                architecture_dd = gr.Dropdown(label="Architecture", choices=list(TRAIN_ARCHITECTURES), value="ViT-Base (précis)", interactive=True)
+            with gr.Accordion("Performances", open=False):
+                with gr.Row():
+                    preprocess_chk = gr.Checkbox(label="Pré-calculer les images une seule fois (cache disque, ~150 Ko/image)", value=False)
+                    loader_workers = gr.Slider(label="Workers DataLoader", minimum=0, maximum=16, value=0, step=1)
+                linear_head_chk = gr.Checkbox(label="Entraînement rapide : tête linéaire sur les embeddings indexés (quelques secondes, un peu moins précis)", value=False)
+                train_dedup_chk = gr.Checkbox(label="Détecter les doublons (jamais à la fois en entraînement et en validation)", value=False)
+                with gr.Row():
+                    precision_dd = gr.Dropdown(label="Précision de calcul", choices=list(TRAIN_PRECISION_CHOICES), value="Auto (mixte sur GPU)", interactive=True)
+                    grad_accum_sl = gr.Slider(label="Accumulation de gradient (batch effectif = batch x N)", minimum=1, maximum=16, value=1, step=1)
+                    freeze_sl = gr.Slider(label="Couches basses gelées", minimum=0, maximum=12, value=0, step=1)
+                early_stop_chk = gr.Checkbox(label="Arrêt anticipé quand la validation ne progresse plus", value=True)
             
             train_btn = gr.Button("🦾 Lancer l'Entraînement", variant="primary", size="lg")
             train_log = gr.Textbox(label="Résultat", lines=10)
             
             train_btn.click(
                 fn=run_train_fixed_rows,
-                inputs=[epochs, batch] + all_train_inputs,
-                outputs=train_log
+                inputs=[epochs, batch, preprocess_chk, loader_workers, linear_head_chk, train_dedup_chk, architecture_dd,
+                        precision_dd, grad_accum_sl, freeze_sl, early_stop_chk] + all_train_inputs,
+                outputs=train_log,
+                concurrency_limit=None
             )
 
+        # --- TAB 3: JOBS ---
+        with gr.Tab("📋 Tâches"):
+            gr.Markdown("Tris et entraînements en attente, en cours et récents (tous utilisateurs).")
+            jobs_table = gr.Dataframe(headers=["N°", "Type", "Modèle", "Dossier", "Statut", "Images", "img/s", "Erreur"], value=list_jobs, interactive=False)
+            with gr.Row():
+                jobs_refresh_btn = gr.Button("🔄 Actualiser", scale=1)
+                cancel_job_id = gr.Number(label="N° de tâche", precision=0, scale=1)
+                cancel_job_btn = gr.Button("⏹️ Annuler la tâche", variant="stop", scale=1)
+            jobs_refresh_btn.click(fn=list_jobs, outputs=jobs_table, api_name="jobs", queue=False)
+            cancel_job_btn.click(fn=cancel_job, inputs=cancel_job_id, outputs=jobs_table, queue=False)
+
+    # Time-to-UI: first page load in the browser
+    demo.load(fn=on_page_load)
+
 if __name__ == "__main__":
+    startup.mark("ui_built")
+    # Optional Prometheus endpoint (metrics.py) next to the UI, e.g. TRIVISION_METRICS_PORT=9108
+    if os.environ.get("TRIVISION_METRICS_PORT"):
+        import metrics
+        metrics.serve(int(os.environ["TRIVISION_METRICS_PORT"]), host=os.environ.get("TRIVISION_METRICS_HOST", "127.0.0.1"))
+    # Optional local classification API (api.py) sharing the UI's loaded models, e.g. TRIVISION_API_PORT=8765
+    if os.environ.get("TRIVISION_API_PORT"):
+        import api
+        api.serve(registry.get, port=int(os.environ["TRIVISION_API_PORT"]), host=os.environ.get("TRIVISION_API_HOST", "127.0.0.1"), models=registry.available_models,
+                  max_batch=int(os.environ.get("TRIVISION_API_MAX_BATCH", 16)), max_wait=float(os.environ.get("TRIVISION_API_MAX_WAIT_MS", 5)) / 1000)
     demo.queue().launch(inbrowser=True, theme=gr.themes.Ocean(), css=css)
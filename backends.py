@@ -0,0 +1,147 @@
+import os
+from types import SimpleNamespace
+
+# Inference backends of ImageSorter. 'pytorch' is the model as loaded by transformers,
+# the others are CPU-oriented and only kept if they pass the parity check.
+BACKENDS = ('pytorch', 'int8', 'onnx', 'onnx-int8', 'compile')
+ONNX_CACHE_DIR = os.path.join(os.getcwd(), "Cache", "onnx")
+
+
+class OnnxModel:
+    """ONNX Runtime session with the bits of a transformers model ImageSorter uses."""
+    def __init__(self, onnx_path, config, name_or_path, threads=None, use_cuda=False):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        providers = ['CPUExecutionProvider']
+        if use_cuda and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        self.config = config
+        self.name_or_path = name_or_path
+
+    @property
+    def dtype(self):
+        import torch
+        return torch.float32
+
+    def __call__(self, pixel_values=None, **kwargs):
+        import torch
+        logits = self.session.run(['logits'], {'pixel_values': pixel_values.cpu().numpy()})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+class ChannelsLastModel:
+    """torch.compile'd model fed channels-last inputs."""
+    def __init__(self, model):
+        import torch
+        self.compiled = torch.compile(model.to(memory_format=torch.channels_last))
+        self.config = model.config
+        self.name_or_path = model.name_or_path
+        self.dtype = model.dtype
+
+    def __call__(self, pixel_values=None, **kwargs):
+        import torch
+        return self.compiled(pixel_values=pixel_values.contiguous(memory_format=torch.channels_last))
+
+
+def quantize_int8(model):
+    """Dynamic INT8 quantization of the Linear layers (weights int8, activations quantized on the fly)."""
+    import copy
+    import torch
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, onnx_path, image_size, quantize=False):
+    """Exports the model (pixel_values -> logits, dynamic batch size) to onnx_path, once."""
+    if os.path.exists(onnx_path):
+        return onnx_path
+    import torch
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    fp32_path = onnx_path[:-len(".onnx")] + ".fp32.onnx" if quantize else onnx_path
+    if not os.path.exists(fp32_path):
+        print(f"Exporting model to ONNX: {fp32_path}")
+        dummy = torch.zeros(1, 3, image_size, image_size)
+        tmp_path = fp32_path + ".tmp"
+        torch.onnx.export(LogitsOnly(model).cpu().float().eval(), (dummy,), tmp_path, input_names=['pixel_values'], output_names=['logits'],
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}}, opset_version=17)
+        os.replace(tmp_path, fp32_path)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = onnx_path + ".tmp"
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, onnx_path)
+    return onnx_path
+
+
+def input_size(image_processor):
+    """Side of the model's input images (what the processor resizes to), 224 if unknown."""
+    size = getattr(image_processor, "size", None) or {}
+    if isinstance(size, int):
+        return size
+    return size.get("height") or size.get("shortest_edge") or 224
+
+
+def parity(reference, candidate, pixel_values, device):
+    """Top-1 agreement and max probability difference of candidate vs reference on a batch."""
+    import torch
+    with torch.inference_mode():
+        ref = reference(pixel_values=pixel_values.to(device, dtype=reference.dtype)).logits.float().cpu().softmax(-1)
+        out = candidate(pixel_values=pixel_values.to(device, dtype=candidate.dtype)).logits.float().cpu().softmax(-1)
+    return {
+        'agreement': (ref.argmax(-1) == out.argmax(-1)).float().mean().item(),
+        'max_prob_diff': (ref - out).abs().max().item(),
+    }
+
+
+def build_backend(classifier, backend, cache_key, threads=None):
+    """Accelerated replacement for classifier.model."""
+    import torch
+    model = classifier.model
+    on_cpu = classifier.device.type == "cpu"
+    if backend == 'int8':
+        if not on_cpu:
+            raise ValueError("int8 dynamic quantization only runs on CPU")
+        return quantize_int8(model)
+    if backend in ('onnx', 'onnx-int8'):
+        onnx_path = os.path.join(ONNX_CACHE_DIR, cache_key, "model.int8.onnx" if backend == 'onnx-int8' else "model.onnx")
+        export_onnx(model, onnx_path, input_size(classifier.image_processor), quantize=backend == 'onnx-int8')
+        return OnnxModel(onnx_path, model.config, model.name_or_path, threads=threads or torch.get_num_threads(), use_cuda=not on_cpu)
+    if backend == 'compile':
+        return ChannelsLastModel(model)
+    raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+
+def apply_backend(classifier, backend, cache_key, sample_pixel_values, threads=None, min_agreement=0.99):
+    """
+    Replaces classifier.model by the `backend` version of it if it gives the same labels as
+    the original on sample_pixel_values. Returns the backend actually in use.
+    """
+    if backend == 'pytorch':
+        return backend
+    try:
+        candidate = build_backend(classifier, backend, cache_key, threads=threads)
+        check = parity(classifier.model, candidate, sample_pixel_values, classifier.device)
+    except ImportError as e:
+        print(f"Backend {backend} unavailable ({e}), using pytorch")
+        return 'pytorch'
+    except Exception as e:
+        print(f"Backend {backend} failed ({e}), using pytorch")
+        return 'pytorch'
+    print(f"Backend {backend}: top-1 agreement {check['agreement']:.1%}, max prob diff {check['max_prob_diff']:.4f}")
+    if check['agreement'] < min_agreement:
+        print(f"Backend {backend} rejected (agreement below {min_agreement:.0%}), using pytorch")
+        return 'pytorch'
+    classifier.model = candidate
+    return backend
@@ -0,0 +1,58 @@
+import argparse
+import time
+
+from scanner import scan_images
+from sorter import ImageSorter
+
+
+def benchmark_batch_sizes(source_dir, model_name="default", batch_sizes=(1, 4, 8, 16, 32), limit=256, warmup=1, backend='pytorch'):
+    """
+    Measures raw inference throughput (img/s) of ImageSorter for several batch sizes.
+    Images are decoded once up front so only preprocessing + forward pass are timed.
+    """
+    files = sorted(scan_images(source_dir))[:limit]
+    # The benchmark images double as the backend parity check set
+    sorter = ImageSorter(model_name=model_name, backend=backend, parity_images=files)
+    if backend != sorter.backend:
+        print(f"Backend {backend} not used, benchmarking {sorter.backend}")
+    if not sorter.classifier:
+        raise RuntimeError(f"Model {model_name} could not be loaded")
+
+    images = [sorter._load_image(f) for f in files]
+    images = [img for img in images if img is not None]
+    if not images:
+        raise RuntimeError(f"No readable images in {source_dir}")
+
+    results = []
+    for bs in batch_sizes:
+        for _ in range(warmup):
+            sorter._predict(images[:bs])
+
+        start = time.perf_counter()
+        for i in range(0, len(images), bs):
+            sorter._predict(images[i:i + bs])
+        elapsed = time.perf_counter() - start
+
+        results.append({'backend': sorter.backend, 'batch_size': bs, 'images': len(images), 'seconds': elapsed, 'img_per_s': len(images) / elapsed})
+        print(f"{sorter.backend:<9} batch_size={bs:>3}  {len(images)} images  {elapsed:7.2f}s  {len(images) / elapsed:8.1f} img/s")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TriVision inference throughput benchmark")
+    parser.add_argument("source_dir", help="Folder containing sample images")
+    parser.add_argument("--model", default="default")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32", help="Comma separated list")
+    parser.add_argument("--limit", type=int, default=256, help="Max number of images to use")
+    parser.add_argument("--backends", default="pytorch", help="Comma separated list, e.g. pytorch,int8,onnx,onnx-int8,compile")
+    args = parser.parse_args()
+
+    for backend in args.backends.split(","):
+        benchmark_batch_sizes(
+            args.source_dir,
+            model_name=args.model,
+            batch_sizes=[int(x) for x in args.batch_sizes.split(",")],
+            limit=args.limit,
+            backend=backend,
+        )
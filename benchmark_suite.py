@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from metrics import Metrics
+from scanner import scan_images
+
+# Reproducible end-to-end benchmark: a synthetic corpus generated from a seed, a tiny randomly
+# initialized ViT (no download, runs on CPU), and JSON results comparable between commits.
+#   python benchmark_suite.py run --output Benchmarks/before.json
+#   python benchmark_suite.py compare Benchmarks/before.json Benchmarks/after.json --threshold 0.1
+
+BENCH_DIR = os.path.join(os.getcwd(), "Cache", "benchmark")
+# Dot folders are not listed as models in the UI
+TINY_MODEL = ".benchmark-vit"
+TRAINED_MODEL = ".benchmark-trained"
+TINY_LABELS = ("class_0", "class_1")
+
+CLASSES = ("flat", "noisy")   # Training classes: cartoon-like flat shapes vs photo-like noise
+FORMATS = {'JPEG': ".jpg", 'PNG': ".png", 'WEBP': ".webp", 'BMP': ".bmp"}
+# (min, max) megapixels of the class images: thumbnails to ~4 MP
+CLASS_SIZES = ((0.005, 0.06), (0.3, 2.0), (2.0, 4.0))
+
+
+def _size(rng, megapixels):
+    aspect = rng.choice((1.0, 4 / 3, 3 / 2, 16 / 9, 3 / 4, 2 / 3))
+    height = max(16, int((megapixels * 1e6 / aspect) ** 0.5))
+    return max(16, int(height * aspect)), height
+
+
+def _synthetic_image(rng, kind, size):
+    """Deterministic test image: flat background + outlined shapes ('flat') or upscaled noise + shapes ('noisy')."""
+    from PIL import Image, ImageDraw
+    width, height = size
+    if kind == 'noisy':
+        base = (max(2, width // 32), max(2, height // 32))
+        img = Image.frombytes("RGB", base, rng.randbytes(base[0] * base[1] * 3)).resize(size, Image.BICUBIC)
+    else:
+        img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(3, 8)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        box = (x0, y0, x0 + rng.randint(1, max(1, width // 2)), y0 + rng.randint(1, max(1, height // 2)))
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        outline = (0, 0, 0) if kind == 'flat' else None
+        if rng.random() < 0.5:
+            draw.rectangle(box, fill=fill, outline=outline, width=max(1, width // 200))
+        else:
+            draw.ellipse(box, fill=fill, outline=outline, width=max(1, width // 200))
+    return img
+
+
+def generate_corpus(root, images_per_class=100, large=6, corrupt=6, max_megapixels=40, seed=0):
+    """
+    Writes the synthetic corpus into root, or reuses it if it was generated with the same parameters:
+      <class>/  images_per_class images per class, JPEG/PNG/WebP/BMP, thumbnails to ~4 MP
+      large/    `large` photos from 12 MP up to max_megapixels (JPEG/PNG/WebP)
+      corrupt/  truncated, empty and mislabelled files
+    Returns the corpus description (parameters, file list, content digest).
+    """
+    params = {'images_per_class': images_per_class, 'large': large, 'corrupt': corrupt, 'max_megapixels': max_megapixels, 'seed': seed}
+    manifest_path = os.path.join(root, "corpus.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            corpus = json.load(f)
+        if corpus['params'] == params:
+            return corpus
+        shutil.rmtree(root)
+
+    print(f"Generating benchmark corpus in {root}")
+    rng = random.Random(seed)
+    files = []
+
+    def save(img, folder, name, fmt):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+        rel = os.path.join(folder, name + FORMATS[fmt])
+        img.save(os.path.join(root, rel), fmt, **({'quality': 90} if fmt in ('JPEG', 'WEBP') else {}))
+        files.append({'path': rel, 'format': fmt, 'size': list(img.size)})
+
+    for kind in CLASSES:
+        for i in range(images_per_class):
+            size = _size(rng, rng.uniform(*rng.choice(CLASS_SIZES)))
+            save(_synthetic_image(rng, kind, size), kind, f"{kind}_{i:04d}", rng.choice(tuple(FORMATS)))
+
+    steps = [12 + (max_megapixels - 12) * i / max(1, large - 1) for i in range(large)]
+    for i, megapixels in enumerate(steps):
+        # WebP is limited to 16383 px per side, BMP would only test the disk at this size
+        save(_synthetic_image(rng, 'noisy', _size(rng, megapixels)), "large", f"large_{i:02d}", ('JPEG', 'PNG', 'WEBP')[i % 3])
+
+    os.makedirs(os.path.join(root, "corrupt"), exist_ok=True)
+    with open(os.path.join(root, files[0]['path']), "rb") as f:
+        sample = f.read()
+    broken = [(".jpg", sample[:len(sample) // 3]), (".png", b""), (".webp", b"not an image"),
+              (".bmp", b"BM" + rng.randbytes(512))]
+    for i in range(corrupt):
+        ext, data = broken[i % len(broken)]
+        rel = os.path.join("corrupt", f"corrupt_{i:02d}{ext}")
+        with open(os.path.join(root, rel), "wb") as f:
+            f.write(data)
+        files.append({'path': rel, 'format': None, 'size': None})
+
+    digest = hashlib.sha256()
+    for entry in sorted(files, key=lambda e: e['path']):
+        digest.update(entry['path'].replace(os.sep, "/").encode())
+        with open(os.path.join(root, entry['path']), "rb") as f:
+            digest.update(f.read())
+    corpus = {'params': params, 'files': files, 'digest': digest.hexdigest()}
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, indent=1)
+    return corpus
+
+
+def make_tiny_model(path, seed=0):
+    """Tiny randomly initialized ViT (2 layers, 64 dims, 224px / 32px patches), saved like a trained model."""
+    import torch
+    from transformers import ViTConfig, ViTForImageClassification, ViTImageProcessor
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    torch.manual_seed(seed)
+    config = ViTConfig(image_size=224, patch_size=32, hidden_size=64, num_hidden_layers=2, num_attention_heads=2, intermediate_size=128,
+                       id2label=dict(enumerate(TINY_LABELS)), label2id={label: i for i, label in enumerate(TINY_LABELS)})
+    ViTForImageClassification(config).save_pretrained(path)
+    ViTImageProcessor(size={"height": 224, "width": 224}).save_pretrained(path)
+    return path
+
+
+def _median_run(runs):
+    """The run with the median duration, so one noisy repetition doesn't skew the result."""
+    return sorted(runs, key=lambda r: r['seconds'])[len(runs) // 2]
+
+
+def bench_scan(corpus_dir, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        files = list(scan_images(corpus_dir, recursive=True))
+        seconds = time.perf_counter() - start
+        runs.append({'seconds': seconds, 'images': len(files), 'images_per_s': len(files) / seconds if seconds else 0.0})
+    return _median_run(runs)
+
+
+def bench_sort(sorter, corpus_dir, repeat, dry_run):
+    """Classification only (dry_run) or full sort with copies into a temporary folder."""
+    runs = []
+    for _ in range(repeat):
+        output_dir = None if dry_run else tempfile.mkdtemp(prefix="trivision-bench-")
+        try:
+            metrics = Metrics()
+            start = time.perf_counter()
+            sorter.sort_directory(corpus_dir, mode='copy', recursive=True, output_dir=output_dir, dry_run=dry_run, metrics=metrics)
+            seconds = time.perf_counter() - start
+        finally:
+            if output_dir:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        report = metrics.report()
+        runs.append({'seconds': seconds, 'images': report['images'], 'images_per_s': report['images'] / seconds if seconds else 0.0,
+                     'stages': report['stages'], 'peak_rss_bytes': report['peak_rss_bytes']})
+    return _median_run(runs)
+
+
+def bench_train(corpus_dir, base_model, epochs, batch_size):
+    from sorter import ImageSorter
+    sorter = ImageSorter(model_name=TRAINED_MODEL, load_model=False, use_cache=False)
+    sources = [{'class_name': kind, 'path': os.path.join(corpus_dir, kind)} for kind in CLASSES]
+    metrics = Metrics()
+    try:
+        start = time.perf_counter()
+        message = sorter.train_model_multi(sources, epochs=epochs, batch_size=batch_size, base_model=base_model, metrics=metrics)
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(os.path.join(sorter.base_model_path, TRAINED_MODEL), ignore_errors=True)
+    if message.startswith("Echec") or message.startswith("Erreur"):
+        raise RuntimeError(message)
+    report = metrics.report()
+    return {'seconds': seconds, 'images': report['images'], 'images_per_s': report['images'] / seconds if seconds else 0.0,
+            'stages': report['stages'], 'peak_rss_bytes': report['peak_rss_bytes']}
+
+
+def _meta(corpus, args):
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(), 'torch': torch.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'threads': torch.get_num_threads(),
+            'corpus': {'params': corpus['params'], 'digest': corpus['digest'], 'files': len(corpus['files'])},
+            'settings': {'repeat': args.repeat, 'batch_size': args.batch_size, 'workers': args.workers, 'device': args.device,
+                         'epochs': args.epochs}}
+
+
+def run(args):
+    # Everything is local: fail instead of silently downloading
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    import torch
+    torch.manual_seed(args.seed)
+    corpus_dir = os.path.join(BENCH_DIR, f"corpus-{args.seed}")
+    corpus = generate_corpus(corpus_dir, images_per_class=args.images, large=args.large, corrupt=args.corrupt,
+                             max_megapixels=args.max_megapixels, seed=args.seed)
+    model_path = make_tiny_model(os.path.join(os.getcwd(), "Models", TINY_MODEL), seed=args.seed)
+
+    from sorter import ImageSorter
+    results = {'meta': _meta(corpus, args), 'stages': {}}
+    stages = results['stages']
+    stages['scan'] = bench_scan(corpus_dir, args.repeat)
+    print(f"scan      {stages['scan']['images']} files  {stages['scan']['seconds']:.3f}s")
+    sorter = ImageSorter(model_name=TINY_MODEL, batch_size=args.batch_size, num_workers=args.workers, use_cache=False, device=args.device)
+    if not sorter.ready:
+        raise RuntimeError(f"Could not load the benchmark model {model_path}")
+    try:
+        for name, dry_run in (('classify', True), ('sort', False)):
+            stages[name] = bench_sort(sorter, corpus_dir, args.repeat, dry_run)
+            print(f"{name:<9} {stages[name]['images']} images  {stages[name]['seconds']:.2f}s  {stages[name]['images_per_s']:.1f} img/s")
+    finally:
+        sorter.close()
+    if not args.skip_train:
+        stages['train'] = bench_train(corpus_dir, model_path, args.epochs, args.batch_size)
+        print(f"train     {stages['train']['images']} images  {stages['train']['seconds']:.2f}s  {stages['train']['images_per_s']:.1f} img/s")
+
+    output = args.output or os.path.join(os.getcwd(), "Benchmarks", f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results: {output}")
+    return results
+
+
+def key_metrics(results):
+    """Flat {name: (value, higher_is_better)} of the figures compared between runs."""
+    metrics = {}
+    for name, stage in results['stages'].items():
+        metrics[f"{name}.images_per_s"] = (stage['images_per_s'], True)
+        for sub, s in stage.get('stages', {}).items():
+            metrics[f"{name}.{sub}.mean_ms"] = (s['mean_ms'], False)
+        if stage.get('peak_rss_bytes'):
+            metrics[f"{name}.peak_rss_mb"] = (stage['peak_rss_bytes'] / 2**20, False)
+    return metrics
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Prints the change of every key metric, flagging those more than `threshold` (relative)
+    worse than the baseline. Returns the list of regressions.
+    """
+    base_meta, meta = baseline['meta'], current['meta']
+    if base_meta['corpus']['digest'] != meta['corpus']['digest']:
+        print("Warning: the two runs used different corpora, results are not comparable")
+    for key in ('platform', 'cpu_count', 'threads', 'torch', 'settings'):
+        if base_meta.get(key) != meta.get(key):
+            print(f"Warning: {key} differs ({base_meta.get(key)} -> {meta.get(key)})")
+
+    base, new = key_metrics(baseline), key_metrics(current)
+    regressions = []
+    print(f"{'metric':<32} {base_meta['commit'] or 'baseline':>10} {meta['commit'] or 'current':>10}  change")
+    for name in sorted(set(base) & set(new)):
+        (old, higher_is_better), (value, _) = base[name], new[name]
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<32} {old:>10.2f} {value:>10.2f}  {change:+.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TriVision reproducible benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Generate the corpus/model if needed and benchmark every stage")
+    run_parser.add_argument("--output", help="Results JSON (default: Benchmarks/<date>-<commit>.json)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--images", type=int, default=100, help="Images per class")
+    run_parser.add_argument("--large", type=int, default=6, help="Large photos (12 MP up to --max-megapixels)")
+    run_parser.add_argument("--corrupt", type=int, default=6, help="Corrupt files")
+    run_parser.add_argument("--max-megapixels", type=float, default=40)
+    run_parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the scan/classify/sort stages (median kept)")
+    run_parser.add_argument("--batch-size", type=int, default=16)
+    run_parser.add_argument("--workers", type=int, default=None, help="Decode/preprocess threads")
+    run_parser.add_argument("--device", default="cpu", help="cpu, cuda...")
+    run_parser.add_argument("--epochs", type=int, default=1)
+    run_parser.add_argument("--skip-train", action="store_true")
+    compare_parser = commands.add_parser("compare", help="Compare two results files, exit code 1 on regression")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Relative slow-down reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.getcwd(), "Cache", "classifications.sqlite")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Content hash of a file (blake2b, 128 bits)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_version(model_path):
+    """
+    Version string of a model: for a local folder (Models/<name>) a hash of its files'
+    names, sizes and mtimes, so retraining a model changes its version.
+    For hub models, the model id itself.
+    """
+    if not model_path or not os.path.isdir(model_path):
+        return str(model_path)
+    h = hashlib.blake2b(digest_size=8)
+    for entry in sorted(os.scandir(model_path), key=lambda e: e.name):
+        if entry.is_file():
+            st = entry.stat()
+            h.update(f"{entry.name}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+class ClassificationCache:
+    """
+    Persistent classification results, keyed by file + model name + model version.
+
+    key_mode='stat' identifies a file by absolute path + size + mtime (no extra I/O).
+    key_mode='hash' identifies it by content hash (survives renames, costs one read per file).
+
+    Safe to share between threads. Last-used timestamps and new entries are written in
+    batches, call flush() (or close()) at the end of a run.
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, key_mode='stat', max_entries=2_000_000, flush_every=500):
+        if key_mode not in ('stat', 'hash'):
+            raise ValueError(f"Unknown cache key mode '{key_mode}'")
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.key_mode = key_mode
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_puts = []
+        self._pending_touch = []
+        # Sharded sorts write from several processes: wait for the lock rather than fail
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS classifications (
+                file_key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                version TEXT NOT NULL,
+                label TEXT NOT NULL,
+                score REAL,
+                scores TEXT,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (file_key, model, version)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON classifications (last_used)")
+        self._conn.commit()
+
+    def file_key(self, path):
+        if self.key_mode == 'hash':
+            return file_digest(path)
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def get(self, path, model, version):
+        """Returns the cached result dict for path, or None."""
+        try:
+            key = self.file_key(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT label, score, scores FROM classifications WHERE file_key=? AND model=? AND version=?",
+                (key, model, version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pending_touch.append((time.time(), key, model, version))
+            if len(self._pending_touch) >= self.flush_every:
+                self._flush_locked()
+        result = {'label': row[0], 'score': row[1]}
+        if row[2]:
+            result['scores'] = json.loads(row[2])
+        return result
+
+    def put(self, path, model, version, result):
+        try:
+            key = self.file_key(path)
+        except OSError:
+            return
+        scores = json.dumps(result['scores']) if result.get('scores') else None
+        with self._lock:
+            self._pending_puts.append((key, model, version, result['label'], result.get('score'), scores, time.time()))
+            if len(self._pending_puts) >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending_puts:
+            self._conn.executemany("INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_puts)
+            self._pending_puts = []
+        if self._pending_touch:
+            self._conn.executemany(
+                "UPDATE classifications SET last_used=? WHERE file_key=? AND model=? AND version=?", self._pending_touch)
+            self._pending_touch = []
+        self._conn.commit()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def invalidate_model(self, model, keep_version=None):
+        """Drops the entries of a model (all of them, or all but `keep_version`)."""
+        with self._lock:
+            self._flush_locked()
+            if keep_version is None:
+                cur = self._conn.execute("DELETE FROM classifications WHERE model=?", (model,))
+            else:
+                cur = self._conn.execute("DELETE FROM classifications WHERE model=? AND version!=?", (model, keep_version))
+            self._conn.commit()
+            return cur.rowcount
+
+    def evict(self):
+        """Keeps only the `max_entries` most recently used entries."""
+        with self._lock:
+            self._flush_locked()
+            count = self._conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            excess = count - self.max_entries
+            if excess <= 0:
+                return 0
+            self._conn.execute(
+                "DELETE FROM classifications WHERE rowid IN (SELECT rowid FROM classifications ORDER BY last_used LIMIT ?)",
+                (excess,))
+            self._conn.commit()
+            return excess
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
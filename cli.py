@@ -0,0 +1,182 @@
+import startup  # First import: start-up timings are measured from here
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+
+from backends import BACKENDS
+from dedup import DEDUP_MODES
+from metrics import Metrics, TOTALS
+from placement import PLACEMENT_MODES
+from scanner import IMAGE_EXTENSIONS, scan_images
+
+
+class ResultWriter:
+    """Writes one row per sorted file, as CSV or JSONL (chosen from the file extension)."""
+    FIELDS = ['path', 'label', 'score', 'uncertain', 'stage', 'scores', 'dest', 'status', 'error', 'duplicate_of']
+
+    def __init__(self, path, fmt=None):
+        self.fmt = fmt or ('jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv')
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._lock = threading.Lock()
+        self.counts = {}
+        if self.fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=self.FIELDS, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, record):
+        with self._lock:
+            self.counts[record['status']] = self.counts.get(record['status'], 0) + 1
+            if self.fmt == 'csv':
+                row = dict(record)
+                if row.get('scores'):
+                    row['scores'] = json.dumps(row['scores'], ensure_ascii=False)
+                self._csv.writerow(row)
+            else:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def read_file_list(path):
+    """Image paths from a text file (one per line), '-' reads stdin."""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line in f:
+            line = line.strip()
+            if line and line.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.abspath(line), os.path.dirname(os.path.abspath(line))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="TriVision AI - headless image sorting")
+    parser.add_argument("sources", nargs="*", help="Source folders to sort")
+    parser.add_argument("--file-list", help="Text file with one image path per line ('-' for stdin)")
+    parser.add_argument("--model", default="default", help="'default' or a model folder name in Models/")
+    parser.add_argument("--mode", choices=PLACEMENT_MODES, default='copy')
+    parser.add_argument("--output-dir", help="Create label folders here instead of inside each source")
+    parser.add_argument("--recursive", action="store_true", help="Also sort images in sub-folders")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None, help="Decode/preprocess threads")
+    parser.add_argument("--prefetch", type=int, default=4, help="Batches decoded ahead of inference")
+    parser.add_argument("--io-workers", type=int, default=4, help="Copy/move threads")
+    parser.add_argument("--device", default=None, help="cpu, cuda, cuda:1... (default: auto)")
+    parser.add_argument("--backend", choices=BACKENDS, default='pytorch', help="Inference backend (int8 / onnx speed up CPU-only machines)")
+    parser.add_argument("--parity-images", help="Folder of sample images used to check the backend gives the same labels")
+    parser.add_argument("--shards", type=int, default=1, help="Worker processes, each with its own model replica")
+    parser.add_argument("--devices", help="Comma separated devices for the shards, e.g. cuda:0,cuda:1 (default: CPU cores split between shards)")
+    parser.add_argument("--exif-thumbnails", action="store_true", help="Classify very large JPEGs from their embedded EXIF thumbnail when it is big enough")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the classification cache")
+    parser.add_argument("--dry-run", action="store_true", help="Classify only, don't copy or move anything")
+    parser.add_argument("--cascade", metavar="MODEL", help="Bigger model that re-classifies the images --model hesitates on")
+    parser.add_argument("--cascade-margin", type=float, default=0.2, help="Escalate when the two best scores are closer than this")
+    parser.add_argument("--threshold", type=float, help="Images scored below this confidence (0-1) go to an _uncertain folder")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, help="Classify duplicate images once: then place them too (reuse), skip them, or hard-link them")
+    parser.add_argument("--dedup-distance", type=int, default=6, help="Max pHash/dHash bit difference for near duplicates (0: exact only)")
+    parser.add_argument("--results", help="Write per-file results to this .csv or .jsonl file")
+    parser.add_argument("--report", metavar="JSON", help="Write the run's per-stage timings, throughput and peak memory to this file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--watch", action="store_true", help="Keep running and sort new images as they are dropped into the source folders")
+    parser.add_argument("--settle", type=float, default=0.3, help="Watch mode: seconds a file must stay unchanged to count as fully written")
+    parser.add_argument("--window", type=float, default=0.1, help="Watch mode: seconds to wait for more arrivals to batch together")
+    parser.add_argument("--no-resume", action="store_true", help="Start over even if the same job was interrupted")
+    parser.add_argument("--no-journal", action="store_true", help="Don't record progress (no resume / undo)")
+    parser.add_argument("--undo", metavar="JOURNAL", help="Undo the moves recorded in a journal file (Journals/*.jsonl) and exit")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.undo:
+        from journal import SortJournal
+        print(f"{SortJournal(args.undo).undo()} files restored")
+        return 0
+    if not args.sources and not args.file_list:
+        parser.error("give at least one source folder or --file-list")
+    if args.watch and not args.sources:
+        parser.error("--watch needs the folders to watch")
+
+    if args.metrics_port:
+        import metrics
+        metrics.serve(args.metrics_port)
+
+    from sorter import ImageSorter
+    sorter = ImageSorter(
+        model_name=args.model,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        prefetch=args.prefetch,
+        io_workers=args.io_workers,
+        use_cache=not args.no_cache,
+        device=args.device,
+        backend=args.backend,
+        parity_images=sorted(scan_images(args.parity_images))[:16] if args.parity_images else None,
+        shards=args.shards,
+        devices=args.devices.split(",") if args.devices else None,
+        cascade=args.cascade,
+        cascade_margin=args.cascade_margin,
+        exif_thumbnails=args.exif_thumbnails,
+    )
+    if not sorter.ready:
+        print(f"Model {args.model} could not be loaded", file=sys.stderr)
+        return 2
+
+    if args.watch:
+        from watch import FolderWatcher
+        writer = ResultWriter(args.results) if args.results else None
+        try:
+            FolderWatcher(sorter, args.sources, recursive=args.recursive, settle=args.settle, window=args.window,
+                          mode=args.mode, output_dir=args.output_dir, dry_run=args.dry_run, threshold=args.threshold,
+                          on_result=writer.write if writer else None).run()
+        finally:
+            sorter.close()
+            if writer:
+                writer.close()
+        return 0
+
+    def items():
+        yield from sorter.iter_sources(args.sources, recursive=args.recursive, output_dir=args.output_dir)
+        if args.file_list:
+            yield from read_file_list(args.file_list)
+
+    journal = None
+    if not args.no_journal and not args.dry_run:
+        from journal import SortJournal
+        journal = SortJournal.for_job(
+            resume=not args.no_resume,
+            sources=[os.path.abspath(s) for s in args.sources], file_list=args.file_list and os.path.abspath(args.file_list),
+            model=args.model, mode=args.mode, output_dir=args.output_dir, recursive=args.recursive)
+        print(f"Journal: {journal.path}")
+
+    writer = ResultWriter(args.results) if args.results else None
+    run_metrics = Metrics(parent=TOTALS)
+    try:
+        summary = sorter.sort_files(items(), mode=args.mode, output_dir=args.output_dir, dry_run=args.dry_run,
+                                    on_result=writer.write if writer else None, journal=journal,
+                                    dedup=args.dedup, dedup_distance=args.dedup_distance, threshold=args.threshold,
+                                    metrics=run_metrics)
+    finally:
+        sorter.close()
+        if writer:
+            writer.close()
+
+    print(summary)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(run_metrics.report(), f, indent=2)
+        print(f"Report: {args.report}")
+    if writer:
+        print(f"Results: {args.results} {writer.counts}")
+        return 1 if writer.counts.get('error') else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+from functools import lru_cache
+
+from cache import file_digest
+from prefetch import PrefetchLoader
+
+# numpy is imported where needed: cli.py imports this module for DEDUP_MODES
+DEDUP_MODES = ('reuse', 'skip', 'link')
+PHASH_SIZE = 32   # pHash: DCT of a 32x32 thumbnail, 8x8 low frequencies kept
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+def _to_uint64(bits):
+    """[N, 64] booleans -> N uint64 hashes."""
+    import numpy as np
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def _load(path):
+    """Content hash + small grayscale thumbnails (dHash 9x8, pHash 32x32) of one file."""
+    import numpy as np
+    from PIL import Image
+    try:
+        digest = file_digest(path)
+    except OSError as e:
+        print(f"Error reading {path}: {e}")
+        return None
+    try:
+        with Image.open(path) as img:
+            # JPEG: decode directly at a reduced scale
+            img.draft('L', (PHASH_SIZE * 2, PHASH_SIZE * 2))
+            gray = img.convert('L')
+            small = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.float32)
+            thumb = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float32)
+        return digest, small, thumb
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+        return digest, None, None
+
+
+def compute_hashes(paths, num_workers=8, batch_size=256):
+    """
+    Content hash, dHash and pHash of every path. Files are read by a thread pool, the
+    perceptual hashes of each batch are computed in one vectorized numpy pass.
+    Returns (digests, dhash, phash, ok): lists/arrays aligned with paths, ok=False when
+    the image could not be decoded (only its content hash is then usable).
+    """
+    import numpy as np
+    dct = _dct_matrix(PHASH_SIZE)
+    n = len(paths)
+    digests = [None] * n
+    dhash = np.zeros(n, dtype=np.uint64)
+    phash = np.zeros(n, dtype=np.uint64)
+    ok = np.zeros(n, dtype=bool)
+
+    def load_batch(indices):
+        return indices, [_load(paths[i]) for i in indices]
+
+    for indices, loaded in PrefetchLoader(range(n), load_batch, batch_size=batch_size, num_workers=num_workers):
+        rows = []
+        for i, item in zip(indices, loaded):
+            if item is None:
+                continue
+            digests[i] = item[0]
+            if item[1] is not None:
+                rows.append((i, item[1], item[2]))
+        if not rows:
+            continue
+        idx = np.array([i for i, _, _ in rows])
+        small = np.stack([s for _, s, _ in rows])
+        thumbs = np.stack([t for _, _, t in rows])
+        # dHash: is each pixel brighter than its right neighbour
+        dhash[idx] = _to_uint64((small[:, :, 1:] > small[:, :, :-1]).reshape(len(rows), 64))
+        # pHash: 2D DCT, 8x8 lowest frequencies compared to their median (DC term excluded)
+        low = (dct @ thumbs @ dct.T)[:, :8, :8].reshape(len(rows), 64)
+        median = np.median(low[:, 1:], axis=1, keepdims=True)
+        phash[idx] = _to_uint64(low > median)
+        ok[idx] = True
+    return digests, dhash, phash, ok
+
+
+def hamming(a, b):
+    return bin(int(a) ^ int(b)).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with the hamming distance: a radius search only
+    visits the children whose edge distance is within radius of the query's distance to the node.
+    """
+    def __init__(self):
+        self.root = None   # [hash, item, {distance: child}]
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = [h, item, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, item, {}]
+                return
+            node = child
+
+    def search(self, h, radius):
+        """Items whose hash is within `radius` of h."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append(node[1])
+            stack.extend(child for dist, child in node[2].items() if d - radius <= dist <= d + radius)
+        return found
+
+
+def find_duplicates(paths, max_distance=6, num_workers=8):
+    """
+    Groups the exact (same content) and near duplicates (pHash and dHash both within
+    max_distance bits) among paths. Returns the groups of 2+ indices into paths, each
+    sorted, so the first index (first in input order) is the group representative.
+    """
+    digests, dhash, phash, ok = compute_hashes(paths, num_workers=num_workers)
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    first = {}
+    for i, digest in enumerate(digests):
+        if digest is None:
+            continue
+        if digest in first:
+            union(first[digest], i)
+        else:
+            first[digest] = i
+
+    if max_distance > 0:
+        tree = BKTree()
+        for i in sorted(first.values()):
+            if not ok[i]:
+                continue
+            for j in tree.search(phash[i], max_distance):
+                if hamming(dhash[i], dhash[j]) <= max_distance:
+                    union(j, i)
+            tree.add(phash[i], i)
+
+    groups = {}
+    for i in range(len(paths)):
+        groups.setdefault(find(i), []).append(i)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def group_split(n, groups, val_fraction=0.1, seed=None):
+    """
+    Random train/val split of n samples where every duplicate group lands entirely on one
+    side, so near-identical images can't leak from training into validation.
+    Returns (train_indices, val_indices).
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    group_of = np.arange(n)
+    for group in groups:
+        group_of[group] = group[0]
+    units = np.unique(group_of)
+    rng.shuffle(units)
+    n_val = int(n * val_fraction)
+    val_units, size = [], 0
+    sizes = np.bincount(group_of, minlength=n)
+    for unit in units:
+        if size >= n_val:
+            break
+        val_units.append(unit)
+        size += sizes[unit]
+    is_val = np.isin(group_of, val_units)
+    return np.flatnonzero(~is_val), np.flatnonzero(is_val)
@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from cache import file_digest, ClassificationCache
+from prefetch import PrefetchLoader
+
+BACKBONE = "google/vit-base-patch16-224-in21k"
+DEFAULT_INDEX_DIR = os.path.join(os.getcwd(), "Cache", "embeddings")
+HEAD_CONFIG = "head_config.json"
+HEAD_WEIGHTS = "linear_head.pt"
+
+
+def torch_device(device):
+    """pipeline()-style device (0, -1, "cpu", "cuda:1"...) -> torch.device."""
+    import torch
+    if isinstance(device, int):
+        return torch.device("cpu" if device < 0 else f"cuda:{device}")
+    return torch.device(device)
+
+
+def is_linear_head(model_path):
+    return os.path.exists(os.path.join(model_path, HEAD_CONFIG))
+
+
+class EmbeddingIndex:
+    """
+    Backbone embeddings of images, computed once: a float16 [rows, dim] memmap plus a SQLite
+    table mapping file content hash -> row. A second table remembers path+size+mtime -> hash,
+    so unchanged files are not hashed again. One index per backbone, see get_index().
+    Thread-safe; several instances or processes can share the files: rows are allocated
+    inside a SQLite write transaction and the memmap follows the file size on disk.
+    """
+    def __init__(self, backbone=BACKBONE, dim=768, index_dir=DEFAULT_INDEX_DIR):
+        self.dim = dim
+        self.dir = os.path.join(index_dir, backbone.replace("/", "__"))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, "vectors.f16")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS paths (path_key TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self._conn.commit()
+        self.capacity = 0
+        self._array = None
+        self._remap()
+
+    @property
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _remap(self):
+        """Maps the whole vectors file, which another instance may have grown."""
+        capacity = os.path.getsize(self.vectors_path) // (self.dim * 2) if os.path.exists(self.vectors_path) else 0
+        if capacity != self.capacity:
+            if self._array is not None:
+                self._array.flush()
+            self._array = np.memmap(self.vectors_path, dtype=np.float16, mode='r+', shape=(capacity, self.dim)) if capacity else None
+            self.capacity = capacity
+
+    def _ensure_capacity(self, n):
+        self._remap()
+        if n <= self.capacity:
+            return
+        new_capacity = max(n, self.capacity * 2, 1024)
+        if self._array is not None:
+            self._array.flush()
+            self._array = None
+        # Only ever grows: the size comes from the file itself, not from this instance
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 2)
+        self.capacity = 0
+        self._remap()
+
+    def hash_for(self, path):
+        """Content hash of path (cached by path+size+mtime), None if unreadable."""
+        try:
+            st = os.stat(path)
+            key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+            with self._lock:
+                row = self._conn.execute("SELECT hash FROM paths WHERE path_key=?", (key,)).fetchone()
+            if row:
+                return row[0]
+            digest = file_digest(path)
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO paths VALUES (?, ?)", (key, digest))
+                self._conn.commit()
+            return digest
+        except OSError as e:
+            print(f"Error reading {path}: {e}")
+            return None
+
+    def lookup(self, hashes):
+        """Row of each hash, -1 if not indexed."""
+        rows = []
+        with self._lock:
+            for h in hashes:
+                row = self._conn.execute("SELECT row FROM files WHERE hash=?", (h,)).fetchone() if h else None
+                rows.append(row[0] if row else -1)
+        return rows
+
+    def add(self, hashes, vectors):
+        """Stores vectors ([N, dim]) under their hashes, returns their rows."""
+        rows = []
+        with self._lock:
+            self._conn.commit()
+            # Write lock on the database: no other instance/process allocates rows meanwhile
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                next_row = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM files").fetchone()[0]
+                self._ensure_capacity(next_row + len(hashes))
+                for h, vec in zip(hashes, vectors):
+                    row = self._conn.execute("SELECT row FROM files WHERE hash=?", (h,)).fetchone()
+                    if row:
+                        rows.append(row[0])
+                        continue
+                    self._array[next_row] = vec
+                    self._conn.execute("INSERT INTO files VALUES (?, ?)", (h, next_row))
+                    rows.append(next_row)
+                    next_row += 1
+                self._array.flush()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return rows
+
+    def vectors(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            if rows.size and rows.max() >= self.capacity:
+                self._remap()
+            if self._array is None:
+                # Nothing stored yet (e.g. every image failed to read)
+                if rows.size:
+                    raise IndexError(f"rows {rows.tolist()[:5]} not in an empty index")
+                return np.zeros((0, self.dim), dtype=np.float16)
+            return np.asarray(self._array[rows])
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(backbone=BACKBONE, dim=768, index_dir=DEFAULT_INDEX_DIR):
+    """The process-wide EmbeddingIndex of a backbone (linear-head models sharing a backbone share it)."""
+    key = (os.path.abspath(index_dir), backbone, dim)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = EmbeddingIndex(backbone, dim=dim, index_dir=index_dir)
+        return _indexes[key]
+
+
+class LinearHeadModel:
+    """Frozen backbone + linear head, callable like a transformers classification model."""
+    def __init__(self, backbone, weight, bias, labels, name_or_path):
+        import copy
+        import torch
+        self.backbone = backbone
+        self.head = torch.nn.Linear(weight.shape[1], weight.shape[0])
+        with torch.no_grad():
+            self.head.weight.copy_(weight)
+            self.head.bias.copy_(bias)
+        self.config = copy.copy(backbone.config)
+        self.config.id2label = {i: label for i, label in enumerate(labels)}
+        self.name_or_path = name_or_path
+
+    @property
+    def dtype(self):
+        return self.backbone.dtype
+
+    def to(self, device):
+        self.backbone.to(device).eval()
+        self.head.to(device).eval()
+        return self
+
+    def embed(self, pixel_values):
+        # CLS token after the final layernorm, as used by ViTForImageClassification
+        return self.backbone(pixel_values=pixel_values).last_hidden_state[:, 0]
+
+    def __call__(self, pixel_values):
+        return SimpleNamespace(logits=self.head(self.embed(pixel_values).float()))
+
+    def classify_vectors(self, vectors):
+        """Vectorized classification of stored embeddings: one matrix multiply."""
+        import torch
+        x = torch.from_numpy(np.asarray(vectors, dtype=np.float32)).to(self.head.weight.device)
+        with torch.inference_mode():
+            return self.head(x)
+
+
+class LinearHeadClassifier:
+    """Pipeline-like wrapper (model, image_processor, device) of a linear-head model folder."""
+    def __init__(self, model_path, device=-1):
+        import torch
+        from transformers import AutoImageProcessor, AutoModel
+        with open(os.path.join(model_path, HEAD_CONFIG), 'r', encoding='utf-8') as f:
+            self.head_config = json.load(f)
+        self.device = torch_device(device)
+        self.image_processor = AutoImageProcessor.from_pretrained(self.head_config['backbone'])
+        backbone = AutoModel.from_pretrained(self.head_config['backbone'])
+        state = torch.load(os.path.join(model_path, HEAD_WEIGHTS), map_location="cpu")
+        self.model = LinearHeadModel(backbone, state['weight'], state['bias'], self.head_config['labels'], model_path).to(self.device)
+        self.index = get_index(self.head_config['backbone'], dim=state['weight'].shape[1])
+
+
+def load_backbone(backbone=BACKBONE, device=None):
+    import torch
+    from transformers import AutoImageProcessor, AutoModel
+    device = torch_device(device if device is not None else (0 if torch.cuda.is_available() else -1))
+    processor = AutoImageProcessor.from_pretrained(backbone)
+    model = AutoModel.from_pretrained(backbone).to(device).eval()
+    return processor, model, device
+
+
+def embed_paths(paths, index, processor, model, device, batch_size=32, num_workers=8):
+    """
+    Index rows of the embeddings of `paths`, computing and storing only the missing ones.
+    Returns one row per path (-1 for unreadable files).
+    Images are decoded like ImageSorter._load_image does (imaging.load_reduced), so a file's
+    vector is the same whether a sort or this function indexed it first.
+    """
+    import torch
+    from backends import input_size
+    from imaging import load_reduced
+
+    hashes = [index.hash_for(p) for p in paths]
+    index.commit()
+    rows = index.lookup(hashes)
+    missing = [i for i, r in enumerate(rows) if r < 0 and hashes[i]]
+    if missing:
+        print(f"Computing {len(missing)} embeddings ({len(paths) - len(missing)} already indexed)")
+
+    size = input_size(processor)
+
+    def load(batch):
+        ok, images = [], []
+        for i in batch:
+            try:
+                images.append(load_reduced(paths[i], size))
+                ok.append(i)
+            except Exception as e:
+                print(f"Error reading {paths[i]}: {e}")
+        pixel_values = processor(images=images, return_tensors="pt")["pixel_values"] if images else None
+        return ok, pixel_values
+
+    for ok, pixel_values in PrefetchLoader(missing, load, batch_size=batch_size, num_workers=num_workers):
+        if not ok:
+            continue
+        with torch.inference_mode():
+            vectors = model(pixel_values=pixel_values.to(device, dtype=model.dtype)).last_hidden_state[:, 0]
+        new_rows = index.add([hashes[i] for i in ok], vectors.float().cpu().numpy().astype(np.float16))
+        for i, row in zip(ok, new_rows):
+            rows[i] = row
+    return rows
+
+
+def train_linear_head(model_name, sources_list, backbone=BACKBONE, steps=300, lr=1e-3, weight_decay=1e-4, val_fraction=0.1, device=None, cancel=None):
+    """
+    Trains a linear classifier on top of indexed backbone embeddings and saves it as
+    Models/<model_name> (head_config.json + linear_head.pt). Images already in the index
+    are not decoded again, so new categories train in seconds.
+    cancel: a threading.Event checked once the embeddings are computed (returns TRAINING_CANCELLED).
+    """
+    import torch
+    from sorter import build_manifest, TRAINING_CANCELLED
+
+    manifest = build_manifest(sources_list)
+    classes = sorted({label for _, label in manifest})
+    if len(classes) < 2:
+        return f"Erreur: Données insuffisantes pour l'entraînement.\nClasses trouvées : {classes}.\nIl faut au moins 2 catégories avec des images."
+
+    processor, model, device = load_backbone(backbone, device)
+    index = get_index(backbone, dim=model.config.hidden_size)
+    rows = np.asarray(embed_paths([p for p, _ in manifest], index, processor, model, device))
+    if cancel is not None and cancel.is_set():
+        return TRAINING_CANCELLED
+    labels = np.asarray([classes.index(c) for _, c in manifest])
+    keep = rows >= 0
+    if len(set(labels[keep].tolist())) < 2:
+        return "Erreur: Données insuffisantes pour l'entraînement.\nIl faut au moins 2 catégories avec des images lisibles."
+    x = torch.from_numpy(index.vectors(rows[keep]).astype(np.float32)).to(device)
+    y = torch.from_numpy(labels[keep]).to(device)
+
+    # Exact duplicates share an index row: split by row so they can't leak into validation
+    from dedup import group_split
+    kept_rows = rows[keep]
+    by_row = {}
+    for i, row in enumerate(kept_rows.tolist()):
+        by_row.setdefault(row, []).append(i)
+    train_idx, val_idx = group_split(len(kept_rows), [g for g in by_row.values() if len(g) > 1], val_fraction)
+    if len(val_idx) == 0:
+        train_idx = val_idx = np.arange(len(kept_rows))
+    train_idx = torch.from_numpy(train_idx).to(device)
+    val_idx = torch.from_numpy(val_idx).to(device)
+
+    head = torch.nn.Linear(x.shape[1], len(classes)).to(device)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+    # Full-batch training: the whole dataset is a few MB of embeddings
+    for _ in range(int(steps)):
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(head(x[train_idx]), y[train_idx])
+        loss.backward()
+        optimizer.step()
+    with torch.no_grad():
+        accuracy = (head(x[val_idx]).argmax(-1) == y[val_idx]).float().mean().item()
+
+    output_dir = os.path.join(os.getcwd(), "Models", model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save({'weight': head.weight.detach().cpu(), 'bias': head.bias.detach().cpu()}, os.path.join(output_dir, HEAD_WEIGHTS))
+    with open(os.path.join(output_dir, HEAD_CONFIG), 'w', encoding='utf-8') as f:
+        json.dump({'type': 'linear_head', 'backbone': backbone, 'labels': classes}, f, indent=2)
+
+    try:
+        ClassificationCache().invalidate_model(model_name)
+    except Exception as e:
+        print(f"Could not invalidate cache for {model_name}: {e}")
+
+    return (f"Entraînement terminé ! Modèle '{model_name}' (tête linéaire) sauvegardé.\n"
+            f"Classes apprises : {', '.join(classes)}\nPrécision validation : {accuracy:.1%}")
+
+
+if __name__ == "__main__":
+    from scanner import scan_images
+
+    parser = argparse.ArgumentParser(description="TriVision embedding index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_index = sub.add_parser("index", help="Compute the embeddings of every image of some folders")
+    p_index.add_argument("folders", nargs="+")
+    p_index.add_argument("--recursive", action="store_true")
+    p_index.add_argument("--batch-size", type=int, default=32)
+    p_train = sub.add_parser("train", help="Train a linear-head model: NAME Class1=path1 Class2=path2 ...")
+    p_train.add_argument("name")
+    p_train.add_argument("classes", nargs="+", help="ClassName=folder, or a single root folder with one sub-folder per class")
+    p_train.add_argument("--steps", type=int, default=300)
+    for p in (p_index, p_train):
+        p.add_argument("--backbone", default=BACKBONE)
+        p.add_argument("--device", default=None)
+    args = parser.parse_args()
+
+    if args.command == "index":
+        processor, model, device = load_backbone(args.backbone, args.device)
+        index = get_index(args.backbone, dim=model.config.hidden_size)
+        paths = [p for folder in args.folders for p in scan_images(folder, recursive=args.recursive)]
+        rows = embed_paths(paths, index, processor, model, device, batch_size=args.batch_size)
+        print(f"{sum(r >= 0 for r in rows)}/{len(paths)} images indexed ({index.count} in the index)")
+    else:
+        sources = [{'class_name': c.split("=", 1)[0], 'path': c.split("=", 1)[1]} if "=" in c else {'class_name': "", 'path': c}
+                   for c in args.classes]
+        print(train_linear_head(args.name, sources, backbone=args.backbone, steps=args.steps, device=args.device))
@@ -0,0 +1,57 @@
+import io
+
+# Above this many pixels (after JPEG draft reduction) an image is refused rather than
+# decoded: a 150 MP RGB bitmap already needs 450 MB
+MAX_DECODE_PIXELS = 150_000_000
+
+# IFD1 tags of the EXIF thumbnail: offset / length of its JPEG data
+_EXIF_THUMB_OFFSET = 0x0201
+_EXIF_THUMB_LENGTH = 0x0202
+
+
+def exif_thumbnail(img, min_size):
+    """Embedded EXIF JPEG thumbnail of img if both its sides are >= min_size, else None."""
+    from PIL import Image, ExifTags
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(_EXIF_THUMB_OFFSET), ifd1.get(_EXIF_THUMB_LENGTH)
+        if not offset or not length:
+            return None
+        tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+        thumb = Image.open(io.BytesIO(tiff[offset:offset + length]))
+        if min(thumb.size) < min_size:
+            return None
+        return thumb.convert("RGB")
+    except Exception:
+        return None
+
+
+def load_reduced(path, size=224, use_exif_thumbnail=False, max_pixels=MAX_DECODE_PIXELS):
+    """
+    Opens an image as RGB, decoded at a reduced size when possible so the cost doesn't grow
+    with the source resolution: JPEGs are DCT-scaled by the decoder (draft) to at least
+    2 x size, other formats are decoded then shrunk with fast box reduction (thumbnail),
+    the shorter side always staying >= 2 x size.
+    With use_exif_thumbnail, a large enough embedded EXIF thumbnail is used instead.
+    Raises ValueError for images above max_pixels.
+    """
+    from PIL import Image
+    target = (2 * size, 2 * size)
+    with Image.open(path) as img:
+        if use_exif_thumbnail and img.format == "JPEG" and img.width * img.height > 16 * target[0] * target[1]:
+            thumb = exif_thumbnail(img, size)
+            if thumb is not None:
+                return thumb
+        if img.format == "JPEG":
+            img.draft("RGB", target)
+        if img.width * img.height > max_pixels:
+            raise ValueError(f"image too large to decode ({img.width}x{img.height})")
+        # Multi-frame files (GIF, TIFF...): first frame only
+        img.seek(0)
+        scale = 2 * size / min(img.size)
+        if scale < 1:
+            img.thumbnail((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR, reducing_gap=2.0)
+        return img.convert("RGB")
@@ -29,6 +29,13 @@ if %ERRORLEVEL% NEQ 0 (
     exit /b
 )
 
+echo.
+echo Installation d'ONNX Runtime (inference CPU acceleree, optionnel)...
+pip install onnx onnxruntime
+if %ERRORLEVEL% NEQ 0 (
+    echo ONNX Runtime non installe, l'inference PyTorch sera utilisee.
+)
+
 echo.
 echo ==================================================
 echo     INSTALLATION SUCCES !
@@ -0,0 +1,177 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+_ids = itertools.count(1)
+
+
+class Job:
+    """
+    A queued sort or training run. `run(job)` does the work in a scheduler thread and returns
+    its summary; it can report progress through job.progress and should stop once job.cancel is set.
+    status: queued -> running -> done / failed / cancelled.
+    """
+    def __init__(self, kind, model, run, key=None, label=None):
+        self.id = next(_ids)
+        self.kind = kind
+        self.model = model
+        self.run = run
+        self.key = key
+        self.label = label or model
+        self.status = 'queued'
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.subscribers = 0   # Callers following the job, see JobScheduler.release
+        # Set by run() to tell whether it really stopped early; None: cancelled if job.cancel is set
+        self.cancelled = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def info(self):
+        """Plain dict for status listings."""
+        progress = self.progress or {}
+        return {'id': self.id, 'kind': self.kind, 'model': self.model, 'label': self.label, 'status': self.status,
+                'processed': progress.get('processed'), 'rate': progress.get('rate'),
+                'created': self.created, 'started': self.started, 'finished': self.finished, 'error': self.error}
+
+
+class JobScheduler:
+    """
+    Runs sort and training jobs from a single queue, each job on its own thread, within
+    `slots` concurrent slots: a sort job takes one slot, a training job `train_slots`
+    (default: all of them, so trainings run alone on the GPU/CPU).
+
+    Queued jobs whose model is already loaded (is_loaded(model)) or used by a running job go
+    first, so jobs on the same model share one loaded replica instead of loading others.
+    A training job at the head of the queue is never overtaken, so it can't be starved.
+    """
+    def __init__(self, slots=2, train_slots=None, is_loaded=None, keep_finished=100):
+        self.slots = max(1, int(slots))
+        self.train_slots = min(self.slots, int(train_slots or self.slots))
+        self.keep_finished = keep_finished
+        self._is_loaded = is_loaded or (lambda model: False)
+        self._queue = []
+        self._jobs = OrderedDict()   # id -> Job, queued, running and recent finished ones
+        self._used = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._dispatch, daemon=True, name="job-scheduler").start()
+
+    def cost(self, job):
+        return self.train_slots if job.kind == 'train' else 1
+
+    def submit(self, kind, model, run, key=None, label=None):
+        """
+        Queues a job. With `key`, an identical queued/running job is returned instead of a new one.
+        Each call subscribes the caller to the returned job, see release().
+        """
+        with self._cond:
+            if key is not None:
+                for job in self._jobs.values():
+                    # A cancelled job still finishing its batch isn't joined, a new one starts
+                    if job.key == key and not job.done.is_set() and not job.cancel.is_set():
+                        job.subscribers += 1
+                        return job
+            job = Job(kind, model, run, key=key, label=label)
+            job.subscribers = 1
+            self._queue.append(job)
+            self._jobs[job.id] = job
+            self._cond.notify_all()
+            return job
+
+    def _next_locked(self):
+        if not self._queue:
+            return None
+        free = self.slots - self._used
+        head = self._queue[0]
+        if head.kind == 'train':
+            return head if self.cost(head) <= free else None
+        if free < 1:
+            return None
+        # Sort jobs ahead of the first training job: loaded models first, FIFO otherwise
+        in_use = {job.model for job in self._jobs.values() if job.status == 'running'}
+        for job in itertools.takewhile(lambda job: job.kind != 'train', self._queue):
+            if job.model in in_use or self._is_loaded(job.model):
+                return job
+        return head
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                job = self._next_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_locked()
+                self._queue.remove(job)
+                self._used += self.cost(job)
+                job.status = 'running'
+                job.started = time.time()
+            threading.Thread(target=self._run, args=(job,), daemon=True, name=f"job-{job.id}").start()
+
+    def _run(self, job):
+        try:
+            job.result = job.run(job)
+            cancelled = job.cancel.is_set() if job.cancelled is None else job.cancelled
+            job.status = 'cancelled' if cancelled else 'done'
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind} {job.label}) failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            with self._cond:
+                self._used -= self.cost(job)
+                self._prune_locked()
+                self._cond.notify_all()
+            job.done.set()
+
+    def _prune_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('done', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def cancel(self, job_id):
+        """Removes a queued job, or asks a running one to stop. False if unknown / already finished."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return False
+            job.cancel.set()
+            if job.status == 'queued':
+                self._queue.remove(job)
+                job.status = 'cancelled'
+                job.finished = time.time()
+                job.done.set()
+                self._cond.notify_all()
+            return True
+
+    def release(self, job_id):
+        """
+        Unsubscribes one caller of submit(); the job is cancelled when its last subscriber
+        leaves. True if it was cancelled.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.subscribers = max(0, job.subscribers - 1)
+            if job.subscribers:
+                return False
+        return self.cancel(job_id)
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """1-based place of a queued job in the queue, 0 once it left the queue."""
+        with self._cond:
+            return self._queue.index(job) + 1 if job in self._queue else 0
+
+    def list(self):
+        with self._cond:
+            return [job.info() for job in self._jobs.values()]
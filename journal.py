@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+JOURNALS_DIR = os.path.join(os.getcwd(), "Journals")
+
+
+def job_key(**params):
+    """Stable id of a sort job (sources, model, mode, outputs...), used as the journal name."""
+    h = hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=8)
+    return h.hexdigest()
+
+
+class SortJournal:
+    """
+    Append-only JSONL journal of a sort job: one 'start' line, one 'file' line per processed
+    image (written in batches of `flush_every`) and an 'end' line once the job completed.
+
+    Re-opening the journal of an interrupted job gives the set of files already placed,
+    so the job resumes where it stopped. Move-mode jobs can be undone from their journal.
+    """
+    def __init__(self, path, flush_every=200):
+        self.path = path
+        self.flush_every = flush_every
+        self.done = set()
+        self.completed = False
+        self._records = []     # placed moves, in order (for undo)
+        self._buffer = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def for_job(cls, resume=True, journals_dir=JOURNALS_DIR, **params):
+        """
+        Journal of the job described by params. With resume=True an interrupted journal is
+        continued; a completed one (or any, with resume=False) is archived and a new one started.
+        """
+        os.makedirs(journals_dir, exist_ok=True)
+        path = os.path.join(journals_dir, f"{job_key(**params)}.jsonl")
+        journal = cls(path)
+        if os.path.exists(path) and (journal.completed or not resume):
+            os.replace(path, path[:-len(".jsonl")] + time.strftime(".%Y%m%d-%H%M%S.jsonl"))
+            journal = cls(path)
+        if not os.path.exists(path):
+            journal._write({'type': 'start', 'time': time.time(), 'params': params})
+        return journal
+
+    @classmethod
+    def find(cls, journals_dir=JOURNALS_DIR, **params):
+        """Existing journal of the job described by params (completed or not), or None."""
+        path = os.path.join(journals_dir, f"{job_key(**params)}.jsonl")
+        return cls(path) if os.path.exists(path) else None
+
+    @staticmethod
+    def _norm(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # Torn last line after a crash
+                    continue
+                kind = rec.get('type')
+                if kind == 'file' and rec.get('status') == 'placed':
+                    self.done.add(self._norm(rec['path']))
+                    self._records.append(rec)
+                elif kind == 'undo':
+                    self.done.discard(self._norm(rec['path']))
+                elif kind == 'end':
+                    self.completed = True
+
+    def _write(self, *records):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_done(self, path):
+        return self._norm(path) in self.done
+
+    def record(self, record, mode):
+        """Adds a sort result (the on_result record of ImageSorter.sort_files)."""
+        rec = {'type': 'file', 'path': record['path'], 'dest': record.get('dest'), 'label': record.get('label'),
+               'status': record['status'], 'mode': mode}
+        with self._lock:
+            self._buffer.append(rec)
+            if rec['status'] == 'placed':
+                self.done.add(self._norm(rec['path']))
+                self._records.append(rec)
+            if len(self._buffer) >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer:
+            self._write(*self._buffer)
+            self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def finish(self, **summary):
+        with self._lock:
+            self._buffer.append({'type': 'end', 'time': time.time(), **summary})
+            self._flush_locked()
+            self.completed = True
+
+    def undo(self):
+        """Moves every file moved by this job back to its original place (newest first). Returns the count."""
+        self.flush()
+        restored = 0
+        undone = []
+        for rec in reversed(self._records):
+            if rec.get('mode') != 'move' or not rec.get('dest') or not self.is_done(rec['path']):
+                continue
+            try:
+                os.makedirs(os.path.dirname(rec['path']), exist_ok=True)
+                shutil.move(rec['dest'], rec['path'])
+            except OSError as e:
+                print(f"Could not restore {rec['path']}: {e}")
+                continue
+            self.done.discard(self._norm(rec['path']))
+            undone.append({'type': 'undo', 'path': rec['path']})
+            restored += 1
+            if len(undone) >= self.flush_every:
+                self._write(*undone)
+                undone = []
+        if undone:
+            self._write(*undone)
+        return restored
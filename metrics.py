@@ -0,0 +1,224 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (seconds), as in a Prometheus histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+# Sort pipeline stages, in pipeline order (other names, e.g. train_step, are reported after them)
+STAGES = ('scan', 'decode', 'preprocess', 'inference', 'placement')
+
+
+class Histogram:
+    """Durations of one stage: bucket counts, sum, max, and the number of items they covered."""
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.items = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, items=1):
+        self.buckets[next(i for i, bound in enumerate(BUCKETS) if seconds <= bound)] += 1
+        self.count += 1
+        self.items += items
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, state):
+        self.buckets = [a + b for a, b in zip(self.buckets, state['buckets'])]
+        self.count += state['count']
+        self.items += state['items']
+        self.sum += state['sum']
+        self.max = max(self.max, state['max'])
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the last bucket)."""
+        rank, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return self.max
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, None if unknown."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil  # Windows: optional
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    except ImportError:
+        return None
+
+
+def peak_gpu_memory():
+    """Peak memory allocated by torch on the GPU in bytes, None without CUDA (torch isn't imported for this)."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return max(torch.cuda.max_memory_allocated(d) for d in range(torch.cuda.device_count()))
+
+
+class Metrics:
+    """
+    Thread-safe per-stage timers (histograms), counters and gauges of a sort or training run.
+    Gauges keep their last and peak value (queue depths...). Everything is also recorded
+    into `parent`, e.g. TOTALS, the process-wide metrics served by serve().
+    """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.peaks = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, items=1):
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds, items)
+        if self.parent:
+            self.parent.observe(stage, seconds, items)
+
+    @contextmanager
+    def timer(self, stage, items=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, items)
+
+    def timed_iter(self, stage, iterable):
+        """Yields from iterable, timing each step (e.g. a lazy folder scan)."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.parent:
+            self.parent.count(name, n)
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+            self.peaks[name] = max(self.peaks.get(name, value), value)
+        if self.parent:
+            self.parent.gauge(name, value)
+
+    def state(self):
+        """Picklable copy of the histograms and counters, see merge()."""
+        with self._lock:
+            return {'histograms': {stage: vars(h).copy() for stage, h in self.histograms.items()},
+                    'counters': dict(self.counters)}
+
+    def merge(self, state):
+        """Adds the state() of another Metrics, e.g. from a shard worker process."""
+        with self._lock:
+            for stage, h in state['histograms'].items():
+                self.histograms.setdefault(stage, Histogram()).merge(h)
+            for name, n in state['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+        if self.parent:
+            self.parent.merge(state)
+
+    def _stages(self):
+        return sorted(self.histograms, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s))
+
+    def report(self):
+        """End-of-run report, a plain dict (JSON-serializable). p50/p95/p99 are histogram bucket upper bounds."""
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            stages = {stage: {'calls': h.count, 'items': h.items, 'total_s': round(h.sum, 3),
+                              'mean_ms': round(1000 * h.sum / h.count, 2) if h.count else 0.0,
+                              'p50_ms': round(1000 * h.quantile(0.5), 2), 'p95_ms': round(1000 * h.quantile(0.95), 2),
+                              'p99_ms': round(1000 * h.quantile(0.99), 2),
+                              'max_ms': round(1000 * h.max, 2)}
+                      for stage, h in ((s, self.histograms[s]) for s in self._stages())}
+            counters = dict(self.counters)
+            peaks = dict(self.peaks)
+        images = counters.get('images', 0)
+        return {'elapsed_s': round(elapsed, 3), 'images': images, 'images_per_s': round(images / elapsed, 2) if elapsed else 0.0,
+                'stages': stages, 'counters': counters, 'queue_peaks': peaks,
+                'peak_rss_bytes': peak_rss(), 'peak_gpu_bytes': peak_gpu_memory()}
+
+    def summary(self, report=None):
+        """Readable version of report(), one line per stage."""
+        r = report or self.report()
+        lines = [f"Mesures : {r['images']} images en {r['elapsed_s']:.1f}s ({r['images_per_s']:.1f} img/s)"]
+        for stage, s in r['stages'].items():
+            lines.append(f"  {stage} : {s['total_s']:.1f}s cumulé | {s['calls']} appels | "
+                         f"moy. {s['mean_ms']:.1f} ms | p95 ≤ {s['p95_ms']:.1f} ms | max {s['max_ms']:.1f} ms")
+        extra = [f"{name} {value / 2**20:.0f} Mo" for name, value in (('RAM max', r['peak_rss_bytes']), ('GPU max', r['peak_gpu_bytes'])) if value]
+        if r['queue_peaks']:
+            extra.append("files max : " + ", ".join(f"{name} {value}" for name, value in r['queue_peaks'].items()))
+        if extra:
+            lines.append("  " + " | ".join(extra))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        out = ["# TYPE trivision_stage_seconds histogram"]
+        with self._lock:
+            for stage in self._stages():
+                h = self.histograms[stage]
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    out.append(f'trivision_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                out.append(f'trivision_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                out.append(f'trivision_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            out.append("# TYPE trivision_stage_items_total counter")
+            out += [f'trivision_stage_items_total{{stage="{stage}"}} {self.histograms[stage].items}' for stage in self._stages()]
+            for name, n in sorted(self.counters.items()):
+                out += [f"# TYPE trivision_{name}_total counter", f"trivision_{name}_total {n}"]
+            for name, value in sorted(self.gauges.items()):
+                out += [f"# TYPE trivision_{name} gauge", f"trivision_{name} {value}",
+                        f"# TYPE trivision_{name}_peak gauge", f"trivision_{name}_peak {self.peaks[name]}"]
+        for name, value in (('peak_rss_bytes', peak_rss()), ('peak_gpu_bytes', peak_gpu_memory())):
+            if value is not None:
+                out += [f"# TYPE trivision_{name} gauge", f"trivision_{name} {value}"]
+        return "\n".join(out) + "\n"
+
+
+# Everything recorded since start-up, across runs
+TOTALS = Metrics()
+
+
+def serve(port, host="127.0.0.1"):
+    """Serves TOTALS at http://host:port/metrics from a daemon thread. Returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = TOTALS.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"Metrics: http://{host}:{port}/metrics")
+    return server
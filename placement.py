@@ -0,0 +1,181 @@
+import errno
+import itertools
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PLACEMENT_MODES = ('copy', 'move', 'hardlink', 'reflink')
+
+# Linux ioctl to clone a file's extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Copy-on-write clone of src into dst. Raises OSError if the filesystem can't do it."""
+    import fcntl  # Not available on Windows -> ImportError, handled by the caller
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+class FilePlacer:
+    """
+    Copies/moves/links files into their destination folders from a small I/O thread pool,
+    so placement overlaps with inference. At most `max_pending` operations are queued:
+    once reached, place() blocks, which keeps memory bounded on very slow disks.
+
+    Modes:
+      copy     - shutil.copy2
+      move     - os.replace (plain rename on the same filesystem), shutil.move otherwise
+      hardlink - os.link, falls back to copy (other filesystem, FAT32, ...)
+      reflink  - copy-on-write clone (btrfs/xfs), falls back to copy
+
+    An existing file is never replaced: when the destination name is taken (e.g. the same
+    file name in two sources), the file is placed as 'name (1).ext', 'name (2).ext'...
+
+    metrics: a metrics.Metrics, each operation is timed as its 'placement' stage.
+    """
+    def __init__(self, mode='copy', max_workers=4, max_pending=256, metrics=None):
+        if mode not in PLACEMENT_MODES:
+            raise ValueError(f"Unknown placement mode '{mode}', expected one of {PLACEMENT_MODES}")
+        self.mode = mode
+        self._created_dirs = set()
+        self._dir_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="placement")
+        self._link_warned = False
+        self.metrics = metrics
+        self.pending = 0   # Operations queued or running
+        self._pending_lock = threading.Lock()
+
+    def ensure_dir(self, folder):
+        """Creates folder once, later calls for the same folder are a set lookup."""
+        if folder in self._created_dirs:
+            return
+        with self._dir_lock:
+            if folder not in self._created_dirs:
+                os.makedirs(folder, exist_ok=True)
+                self._created_dirs.add(folder)
+
+    def _copy_fallback(self, src, dst, e):
+        if not self._link_warned:
+            self._link_warned = True
+            print(f"{self.mode} not possible ({e}), falling back to copy")
+        shutil.copy2(src, dst)
+
+    def _place(self, src, dst):
+        if self.metrics is None:
+            return self._do_place(src, dst)
+        with self.metrics.timer('placement'):
+            return self._do_place(src, dst)
+
+    @staticmethod
+    def same_file(src, dst):
+        """True if dst is src or a copy of it (copy2 keeps the size and mtime)."""
+        try:
+            if os.path.samefile(src, dst):
+                return True
+            a, b = os.stat(src), os.stat(dst)
+        except OSError:
+            return False
+        if a.st_size != b.st_size:
+            return False
+        if a.st_mtime_ns == b.st_mtime_ns:
+            return True
+        # Coarser mtime on some targets (FAT: 2 s): only trust the content then
+        if abs(a.st_mtime - b.st_mtime) < 2:
+            from cache import file_digest
+            return file_digest(src) == file_digest(dst)
+        return False
+
+    def reserve(self, src, dst):
+        """
+        Creates an empty dst, or 'name (1).ext', 'name (2).ext'... if it exists, and returns
+        (path created, False). O_EXCL makes the reservation atomic across threads and processes.
+        Returns (path, True) instead when one of these names already holds src, placed by an
+        earlier run (copy modes), so re-running a sort doesn't place files twice.
+        """
+        root, ext = os.path.splitext(dst)
+        for i in itertools.count():
+            candidate = dst if i == 0 else f"{root} ({i}){ext}"
+            try:
+                fd = os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.mode != 'move' and self.same_file(src, candidate):
+                    return candidate, True
+                continue
+            os.close(fd)
+            return candidate, False
+
+    def _do_place(self, src, dst):
+        self.ensure_dir(os.path.dirname(dst))
+        dst, placed = self.reserve(src, dst)
+        if placed:
+            return dst
+        # Every operation below replaces the empty placeholder reserved above
+        try:
+            if self.mode == 'move':
+                try:
+                    os.replace(src, dst)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(src, dst)
+            elif self.mode == 'hardlink':
+                tmp = os.path.join(os.path.dirname(dst), f".{uuid.uuid4().hex}.tmp")
+                try:
+                    os.link(src, tmp)
+                    os.replace(tmp, dst)
+                except OSError as e:
+                    self._copy_fallback(src, dst, e)
+            elif self.mode == 'reflink':
+                try:
+                    reflink(src, dst)
+                except (OSError, ImportError) as e:
+                    self._copy_fallback(src, dst, e)
+            else:
+                shutil.copy2(src, dst)
+        except BaseException:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            raise
+        return dst
+
+    def place(self, src, dest_folder, filename=None, callback=None):
+        """
+        Queues src to be placed in dest_folder (under `filename`, default: same name).
+        callback(src, dst, error) is called from an I/O thread when done (error is None on success),
+        dst being the path actually used (see reserve).
+        """
+        dst = os.path.join(dest_folder, filename or os.path.basename(src))
+        self._slots.acquire()
+        with self._pending_lock:
+            self.pending += 1
+        future = self._executor.submit(self._place, src, dst)
+
+        def _done(f):
+            with self._pending_lock:
+                self.pending -= 1
+            self._slots.release()
+            error = f.exception()
+            if callback:
+                callback(src, dst if error else f.result(), error)
+            elif error:
+                print(f"Error placing {src}: {error}")
+
+        future.add_done_callback(_done)
+        return future
+
+    def close(self):
+        """Waits for all queued operations."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
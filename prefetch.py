@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+class PrefetchLoader:
+    """
+    Producer/consumer loader: groups `items` into batches and runs `load_fn(batch)` in a
+    thread pool, ahead of the consumer, through a bounded queue of `prefetch` batches.
+    Batches are yielded in input order. Items can be any iterable (consumed lazily).
+
+    stats['consumer_stall'] = time the consumer waited for a batch (loading is the bottleneck)
+    stats['producer_stall'] = time the producer waited for queue space (consumer is the bottleneck)
+    """
+    def __init__(self, items, load_fn, batch_size=8, num_workers=4, prefetch=4):
+        self.items = items
+        self.load_fn = load_fn
+        self.batch_size = max(1, int(batch_size))
+        self.num_workers = max(1, int(num_workers))
+        self.prefetch = max(1, int(prefetch))
+        self.stats = {'batches': 0, 'load_time': 0.0, 'producer_stall': 0.0, 'consumer_stall': 0.0}
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def _timed_load(self, batch):
+        start = time.perf_counter()
+        try:
+            return self.load_fn(batch)
+        finally:
+            with self._lock:
+                self.stats['load_time'] += time.perf_counter() - start
+
+    def _put(self, q, obj, stop):
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                q.put(obj, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats['producer_stall'] += time.perf_counter() - start
+
+    def _produce(self, executor, q, stop):
+        batch = []
+        try:
+            for item in self.items:
+                if stop.is_set():
+                    return
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._put(q, executor.submit(self._timed_load, batch), stop)
+                    batch = []
+            if batch:
+                self._put(q, executor.submit(self._timed_load, batch), stop)
+        except Exception as e:
+            self._put(q, e, stop)
+        finally:
+            self._put(q, _DONE, stop)
+
+    def __iter__(self):
+        q = self._queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="prefetch")
+        producer = threading.Thread(target=self._produce, args=(executor, q, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                obj = q.get()
+                if obj is _DONE:
+                    break
+                if isinstance(obj, Exception):
+                    raise obj
+                result = obj.result()
+                self.stats['consumer_stall'] += time.perf_counter() - start
+                self.stats['batches'] += 1
+                yield result
+        finally:
+            # Consumer finished or stopped early: unblock the producer and drop pending batches
+            stop.set()
+            while True:
+                try:
+                    obj = q.get_nowait()
+                except queue.Empty:
+                    break
+                if hasattr(obj, "cancel"):
+                    obj.cancel()
+            producer.join()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def queue_depth(self):
+        """Batches loaded (or loading) ahead of the consumer."""
+        return self._queue.qsize() if self._queue else 0
+
+    def summary(self):
+        s = self.stats
+        return (f"{s['batches']} lots | décodage {s['load_time']:.1f}s (cumulé) | "
+                f"inférence en attente du décodage {s['consumer_stall']:.1f}s | "
+                f"décodage en attente de l'inférence {s['producer_stall']:.1f}s")
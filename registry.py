@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MODELS_DIR = os.path.join(os.getcwd(), "Models")
+
+
+def _memory_pressure(min_free_gpu_mb, max_rss_mb):
+    """True when the GPU or the process is above the configured memory limits."""
+    try:
+        import torch
+        if min_free_gpu_mb and torch.cuda.is_available():
+            free, _ = torch.cuda.mem_get_info()
+            if free / 2**20 < min_free_gpu_mb:
+                return True
+    except Exception:
+        pass
+    if max_rss_mb:
+        try:
+            import psutil
+            if psutil.Process().memory_info().rss / 2**20 > max_rss_mb:
+                return True
+        except ImportError:
+            pass
+    return False
+
+
+class ModelRegistry:
+    """
+    Keeps up to `max_models` loaded ImageSorter instances in an LRU cache, so switching
+    back to an already used model is instant. Models can be loaded in the background
+    (preload) while the UI stays responsive, get() then waits for that load.
+    The least recently used models are also evicted while free GPU memory is below
+    `min_free_gpu_mb` or the process RSS is above `max_rss_mb` (needs psutil).
+
+    dependencies(name) lists models that `name` reuses (e.g. the big model of a cascade):
+    they are loaded first, through the registry, and passed to factory(name, *models)
+    (None for one that failed to load), so their weights are never loaded twice.
+    """
+    def __init__(self, factory, max_models=3, min_free_gpu_mb=1024, max_rss_mb=None, dependencies=None):
+        self.factory = factory
+        self.dependencies = dependencies or (lambda name: [])
+        self.max_models = max(1, int(max_models))
+        self.min_free_gpu_mb = min_free_gpu_mb
+        self.max_rss_mb = max_rss_mb
+        self._models = OrderedDict()   # name -> Future[ImageSorter]
+        self._lock = threading.Lock()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self._listing = None
+        self._listing_mtime = None
+
+    def _evict(self, keep):
+        while len(self._models) > self.max_models or (len(self._models) > 1 and _memory_pressure(self.min_free_gpu_mb, self.max_rss_mb)):
+            name = next(iter(self._models))
+            if name == keep:
+                break
+            print(f"Unloading model {name}")
+            del self._models[name]
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+
+    def _load(self, name, dependencies):
+        # Submitted before this load to the single loader thread: already finished, no wait
+        models = [None if f.exception() else f.result() for f in dependencies]
+        sorter = self.factory(name, *models)
+        with self._lock:
+            self._evict(keep=name)
+        return sorter
+
+    def _preload_locked(self, name):
+        future = self._models.get(name)
+        if future is not None and not (future.done() and future.exception()):
+            self._models.move_to_end(name)
+            return future
+        dependencies = [self._preload_locked(dep) for dep in self.dependencies(name)]
+        future = self._loader.submit(self._load, name, dependencies)
+        self._models[name] = future
+        return future
+
+    def preload(self, name):
+        """Starts loading `name` in the background (no-op if loaded/loading). Returns the Future."""
+        with self._lock:
+            return self._preload_locked(name)
+
+    def get(self, name):
+        """Returns the loaded ImageSorter for `name`, loading it if needed."""
+        return self.preload(name).result()
+
+    def is_loaded(self, name):
+        with self._lock:
+            future = self._models.get(name)
+        return future is not None and future.done() and not future.exception()
+
+    def loaded(self):
+        with self._lock:
+            return [name for name, f in self._models.items() if f.done() and not f.exception()]
+
+    def invalidate(self, name):
+        """Drops a model (e.g. after it was retrained), the next get() reloads it."""
+        with self._lock:
+            self._models.pop(name, None)
+
+    def available_models(self, models_dir=MODELS_DIR):
+        """Sub-folders of Models/, rescanned only when the folder itself changed.
+        Hidden folders (e.g. the .default snapshot) are not listed."""
+        if not os.path.exists(models_dir):
+            os.makedirs(models_dir)
+        mtime = os.stat(models_dir).st_mtime_ns
+        if self._listing is None or mtime != self._listing_mtime:
+            with os.scandir(models_dir) as it:
+                self._listing = sorted(entry.name for entry in it if entry.is_dir() and not entry.name.startswith('.'))
+            self._listing_mtime = mtime
+        return list(self._listing)
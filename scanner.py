@@ -0,0 +1,35 @@
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def scan_images(root, recursive=False, extensions=IMAGE_EXTENSIONS, exclude=()):
+    """
+    Lazily yields the paths of image files under root, using os.scandir.
+    The extension is checked on the name first, and the file type comes from the
+    directory entry itself, so no extra stat() per file on Windows / Linux.
+    Folders listed in `exclude` (e.g. the sort destinations) are not descended into.
+    """
+    exclude = {os.path.normcase(os.path.abspath(p)) for p in exclude if p}
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.name.lower().endswith(extensions) and entry.is_file():
+                            yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            if os.path.normcase(os.path.abspath(entry.path)) not in exclude:
+                                stack.append(entry.path)
+                    except OSError as e:
+                        print(f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            print(f"Error listing {folder}: {e}")
+
+
+def list_subdirs(root):
+    """Names of the direct subfolders of root."""
+    with os.scandir(root) as it:
+        return [entry.name for entry in it if entry.is_dir()]
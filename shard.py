@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from prefetch import PrefetchLoader
+
+# Per-process replica, created by _init_worker
+_sorter = None
+
+
+def _init_worker(counter, status, model_name, devices, threads, options):
+    """
+    Loads the model replica of one worker process, on its device / CPU core slice.
+    Reports (worker index, labels or None, error) on `status`: a Pool can't return initializer results.
+    """
+    global _sorter
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    try:
+        import torch
+        device = devices[index % len(devices)] if devices else -1
+        if threads:
+            torch.set_num_threads(threads)
+            if not devices and hasattr(os, "sched_setaffinity"):
+                cores = sorted(os.sched_getaffinity(0))
+                own = cores[index * threads:(index + 1) * threads]
+                if own:
+                    os.sched_setaffinity(0, own)
+        from sorter import ImageSorter
+        _sorter = ImageSorter(model_name=model_name, num_workers=max(2, threads or 2), device=device, **options)
+        status.put((index, _labels(), None))
+    except Exception as e:
+        # Not raised: the Pool would respawn the worker forever
+        _sorter = None
+        status.put((index, None, str(e)))
+
+
+def _labels():
+    if not _sorter or not _sorter.classifier:
+        return None
+    return list(_sorter.classifier.model.config.id2label.values())
+
+
+def _classify_chunk(paths):
+    """Classifies a chunk of paths in a worker. Returns one result (or None) per path, and the chunk's metrics."""
+    from metrics import Metrics
+    metrics = Metrics()
+    results = []
+    loader = PrefetchLoader(paths, lambda paths: _sorter._prepare_batch(paths, metrics), batch_size=_sorter.batch_size,
+                            num_workers=_sorter.num_workers, prefetch=2)
+    for batch in loader:
+        results.extend(_sorter._infer_batch(batch, metrics))
+    if _sorter.cache:
+        _sorter.cache.flush()
+    return results, metrics.state()
+
+
+def _evict_cache():
+    """Trims the (shared, on-disk) classification cache, see ClassificationCache.evict."""
+    if _sorter and _sorter.cache:
+        _sorter.cache.flush()
+        return _sorter.cache.evict()
+    return 0
+
+
+class ShardPool:
+    """
+    `processes` worker processes, each with its own ImageSorter replica, pinned round-robin
+    to `devices` (e.g. ["cuda:0", "cuda:1"]) or, on CPU, to its own slice of cores.
+    Workers only classify: the caller places the files, so there is a single writer per
+    destination folder. Chunks of paths are sent in order with a bounded number in flight.
+    Other keyword arguments (batch_size, backend, cascade...) are passed to the workers' ImageSorter.
+    A worker dying (out of memory, crash) breaks the pool: the pending chunks raise
+    RuntimeError instead of waiting forever, and a new ShardPool is needed.
+    """
+    def __init__(self, model_name, processes, devices=None, **options):
+        self.processes = max(1, int(processes))
+        threads = max(1, (os.cpu_count() or 1) // self.processes)
+        ctx = multiprocessing.get_context("spawn")
+        counter = ctx.Value('i', 0)
+        status = ctx.Queue()
+        self.stats = {'chunks': 0, 'wait': 0.0}
+        self._pool = ProcessPoolExecutor(self.processes, mp_context=ctx, initializer=_init_worker,
+                                         initargs=(counter, status, model_name, list(devices or []), threads, options))
+        # Every replica must load: a failed one would return None for all of its chunks.
+        # The probes start the workers and fail with BrokenProcessPool if one dies while loading.
+        probes = [self._pool.submit(_labels) for _ in range(self.processes)]
+        reports = []
+        while len(reports) < self.processes:
+            try:
+                reports.append(status.get(timeout=1.0))
+            except queue.Empty:
+                broken = next((f.exception() for f in probes if f.done() and f.exception()), None)
+                if broken is not None:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    raise RuntimeError(f"Model {model_name}: a worker process died while loading ({broken})")
+        failed = [f"worker {index}: {error or 'model not loaded'}" for index, labels, error in reports if labels is None]
+        if not failed and any(labels != reports[0][1] for _, labels, _ in reports):
+            failed = ["workers loaded different labels"]
+        if failed:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            raise RuntimeError(f"Model {model_name} could not be loaded in the worker processes ({'; '.join(failed)})")
+        self.labels = reports[0][1]
+
+    def _pop(self, pending, metrics=None):
+        chunk, future = pending.popleft()
+        start = time.perf_counter()
+        try:
+            results, state = future.result()
+        except BrokenProcessPool as e:
+            raise RuntimeError(f"A shard worker process died, sort stopped ({e})") from e
+        self.stats['wait'] += time.perf_counter() - start
+        self.stats['chunks'] += 1
+        if metrics:
+            metrics.merge(state)
+            metrics.gauge('shard_chunks', len(pending))
+        return {'paths': [p for p, _ in chunk], 'roots': [r for _, r in chunk]}, results
+
+    def imap(self, items, chunk_size=64, metrics=None):
+        """
+        Yields (batch, results) for chunks of (path, root) items, in input order.
+        The workers' decode/inference timings are merged into `metrics` (a metrics.Metrics).
+        """
+        pending = deque()
+        max_pending = 2 * self.processes
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                pending.append((chunk, self._pool.submit(_classify_chunk, [p for p, _ in chunk])))
+                chunk = []
+                if len(pending) >= max_pending:
+                    yield self._pop(pending, metrics)
+        if chunk:
+            pending.append((chunk, self._pool.submit(_classify_chunk, [p for p, _ in chunk])))
+        while pending:
+            yield self._pop(pending, metrics)
+
+    def evict_cache(self):
+        """Cache eviction, run by one worker (this process has no cache when sharding)."""
+        return self._pool.submit(_evict_cache).result()
+
+    def summary(self):
+        return f"{self.processes} processus | {self.stats['chunks']} lots | attente des processus {self.stats['wait']:.1f}s"
+
+    def close(self):
+        self._pool.shutdown(wait=True)
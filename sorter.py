@@ -1,30 +1,251 @@
+import math
 import os
 import shutil
-import torch
-from transformers import pipeline, AutoModelForImageClassification, AutoFeatureExtractor, TrainingArguments, Trainer, AutoImageProcessor
-from datasets import load_dataset, Image
-import glob
-from torchvision import transforms
+import threading
+import time
+from collections import deque
+from prefetch import PrefetchLoader
+from placement import FilePlacer
+from cache import ClassificationCache, model_version
+from scanner import scan_images, list_subdirs
+from metrics import Metrics, TOTALS
+import startup
+
+# torch / transformers / datasets are imported where needed, so importing this module is instant
+# and training-only dependencies are only loaded when a training starts.
+
+# Default model, in order of preference
+DEFAULT_MODEL_REPOS = ("deepghs/anime_real_cls", "google/vit-base-patch16-224")
+DEFAULT_MODEL_FILES = ["*.json", "*.safetensors", "*.py", "*.txt"]
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.getcwd(), "Models", ".default")
+
+# Base models for training: the ViT is the most accurate, the small timm models are meant
+# as the fast first stage of a cascade (ImageSorter(cascade=...))
+TRAIN_BASE_MODELS = {
+    'vit-base': "google/vit-base-patch16-224-in21k",
+    'mobilenet': "timm/mobilenetv3_large_100.ra_in1k",
+    'efficientnet': "timm/efficientnet_b0.ra_in1k",
+}
+
+# Images scored below the sort's confidence threshold go here instead of a label folder
+UNCERTAIN_FOLDER = "_uncertain"
+
+# Training precisions: 'auto' = bf16 on GPUs that support it, fp16 on other GPUs, fp32 on CPU
+TRAIN_PRECISIONS = ('auto', 'fp32', 'fp16', 'bf16')
+
+# Returned by the training functions when their `cancel` event stopped them (nothing saved)
+TRAINING_CANCELLED = "Entraînement annulé."
+# Containers of a backbone's repeated blocks, for freeze_lower_layers (ViT: encoder.layer, timm: blocks)
+BLOCK_CONTAINERS = ('layer', 'layers', 'blocks', 'stages')
+
+
+def results_from_probs(probs, id2label):
+    """[N, num_labels] probabilities -> [{'label', 'score', 'scores'}], scores = every label's probability."""
+    labels = [id2label[i] for i in range(probs.shape[-1])]
+    top, ids = probs.max(dim=-1)
+    return [{'label': labels[i], 'score': s, 'scores': {label: round(p, 5) for label, p in zip(labels, row)}}
+            for i, s, row in zip(ids.tolist(), top.tolist(), probs.tolist())]
+
+
+def resolve_precision(precision):
+    """TRAIN_PRECISIONS value -> the precision actually usable on this machine."""
+    import torch
+    cuda = torch.cuda.is_available()
+    if precision == 'auto':
+        return ('bf16' if torch.cuda.is_bf16_supported() else 'fp16') if cuda else 'fp32'
+    if precision == 'fp16' and not cuda:
+        print("fp16 needs a GPU, training in fp32")
+        return 'fp32'
+    return precision
+
+
+def freeze_lower_layers(model, count):
+    """
+    Freezes the embeddings / stem and the first `count` blocks of the backbone (at least one
+    block is left trainable). Blocks are those of the longest BLOCK_CONTAINERS module, parameters
+    registered before its block `count` are frozen. Returns the number of frozen blocks.
+    """
+    if count <= 0:
+        return 0
+    containers = [(name, len(list(module.children()))) for name, module in model.named_modules()
+                  if name.rsplit(".", 1)[-1] in BLOCK_CONTAINERS]
+    containers = [c for c in containers if c[1] > 1]
+    if not containers:
+        print("No encoder blocks found, nothing frozen")
+        return 0
+    name, length = max(containers, key=lambda c: c[1])
+    count = min(count, length - 1)
+    first_trainable = f"{name}.{count}."
+    for param_name, param in model.named_parameters():
+        if param_name.startswith(first_trainable):
+            break
+        param.requires_grad = False
+    return count
+
+class ProcessorTransform:
+    """
+    datasets transform: one processor call for the whole batch of examples.
+    A class rather than a closure so spawned DataLoader workers (Windows) can pickle it.
+    """
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, examples):
+        examples["pixel_values"] = list(self.processor([img.convert("RGB") for img in examples["image"]], return_tensors="pt")["pixel_values"])
+        return examples
+
+
+def collate_examples(batch):
+    """Collator of the ProcessorTransform examples (module-level, so it pickles)."""
+    import torch
+    return {
+        'pixel_values': torch.stack([x['pixel_values'] for x in batch]),
+        'labels': torch.tensor([x['label'] for x in batch])
+    }
+
 
 class ImageSorter:
-    def __init__(self, model_name="default"):
-        self.device = 0 if torch.cuda.is_available() else -1
+    def __init__(self, model_name="default", batch_size=8, num_workers=None, prefetch=4, io_workers=4, use_cache=True, cache=None, load_model=True, device=None, backend='pytorch', parity_images=None, shards=1, devices=None, cascade=None, cascade_margin=0.2, exif_thumbnails=False):
+        import torch
+        # device: None = auto, else anything pipeline() accepts ("cpu", "cuda:1", 0, -1...)
+        self.device = device if device is not None else (0 if torch.cuda.is_available() else -1)
         self.model_name = model_name
+        self.batch_size = max(1, int(batch_size))
+        # Decode/preprocess threads running ahead of inference
+        self.num_workers = num_workers or min(8, os.cpu_count() or 1)
+        self.prefetch = prefetch
+        # Copy/move threads, so slow disks don't stall inference
+        self.io_workers = io_workers
+        # Large images are decoded at reduced size (imaging.py), optionally from their EXIF thumbnail
+        self.exif_thumbnails = exif_thumbnails
         self.base_model_path = os.path.join(os.getcwd(), "Models")
         
         print(f"Initializing Sorter with model: {self.model_name}")
-        self.classifier = self._load_model()
+        # shards > 1: classification runs in worker processes (shard.py), each with its own
+        # model replica, this process only schedules and places files
+        self.shard_pool = None
+        if load_model and shards and int(shards) > 1:
+            from embeddings import is_linear_head
+            if is_linear_head(os.path.join(self.base_model_path, self.model_name)):
+                # The embedding index is appended to by a single process only
+                print(f"Model {self.model_name} can't be sharded, using a single process")
+            else:
+                from shard import ShardPool
+                self.shard_pool = ShardPool(model_name, shards, devices=devices, batch_size=self.batch_size, backend=backend, use_cache=use_cache,
+                                            cascade=cascade.model_name if isinstance(cascade, ImageSorter) else cascade,
+                                            cascade_margin=cascade_margin, exif_thumbnails=exif_thumbnails)
+                load_model = False
+        # load_model=False: sorter only used for training
+        self.classifier = self._load_model() if load_model else None
+        if self.classifier:
+            startup.mark(f"model_loaded:{self.model_name}")
+        # Linear-head models (embeddings.py) classify stored backbone embeddings
+        self.embedding_index = getattr(self.classifier, "index", None)
+        from backends import input_size
+        self.decode_size = input_size(getattr(self.classifier, "image_processor", None))
+
+        # Persistent results cache, keyed by file + model version (changes when the model is retrained)
+        self.model_version = model_version(getattr(self.classifier.model, "name_or_path", None)) if self.classifier else None
+        self.cache = None
+        if use_cache and self.classifier:
+            try:
+                self.cache = cache or ClassificationCache()
+                self.cache.invalidate_model(self.model_name, keep_version=self.model_version)
+            except Exception as e:
+                print(f"Classification cache disabled: {e}")
+                self.cache = None
+
+        # Optional accelerated inference (backends.py), kept only if it gives the same labels
+        self.backend = 'pytorch'
+        if backend != 'pytorch' and self.classifier:
+            if self.embedding_index is not None or getattr(self.classifier, "image_processor", None) is None:
+                print(f"Backend {backend} not supported for model {self.model_name}, using pytorch")
+            else:
+                from backends import apply_backend
+                self.backend = apply_backend(self.classifier, backend, f"{self.model_name}-{self.model_version}", self._parity_sample(parity_images))
+
+        # Cascade: this (fast) model classifies everything, images whose top-2 score margin is
+        # below cascade_margin are classified again by the `cascade` (bigger) model: a model
+        # name, or an already loaded ImageSorter whose weights are then shared (ModelRegistry)
+        self.cascade = None
+        self.cascade_name = cascade.model_name if isinstance(cascade, ImageSorter) else cascade   # Also set when the cascade runs in the shard workers
+        self.cascade_margin = cascade_margin
+        if isinstance(cascade, ImageSorter):
+            self.cascade = cascade if cascade.classifier else None
+            if self.cascade is None:
+                print(f"Cascade model {cascade.model_name} isn't loaded, using {self.model_name} alone")
+            elif set(self.cascade.labels()) != set(self.labels()):
+                print(f"Warning: {cascade.model_name} and {self.model_name} don't have the same labels, escalated images get {cascade.model_name}'s labels")
+        elif cascade and self.classifier:
+            self.cascade = ImageSorter(model_name=cascade, batch_size=self.batch_size, num_workers=self.num_workers, use_cache=use_cache,
+                                       cache=self.cache, device=device, backend=backend, exif_thumbnails=exif_thumbnails)
+            if not self.cascade.classifier:
+                print(f"Cascade model {cascade} could not be loaded, using {self.model_name} alone")
+                self.cascade = None
+            elif set(self.cascade.labels()) != set(self.labels()):
+                print(f"Warning: {cascade} and {self.model_name} don't have the same labels, escalated images get {cascade}'s labels")
+
+    def labels(self):
+        if self.shard_pool:
+            return self.shard_pool.labels
+        return list(self.classifier.model.config.id2label.values()) if self.classifier else []
+
+    @property
+    def ready(self):
+        """True when the model is loaded (here or in the shard processes)."""
+        return bool(self.classifier or self.shard_pool)
+
+    def close(self):
+        if self.shard_pool:
+            self.shard_pool.close()
+            self.shard_pool = None
+
+    def _parity_sample(self, image_paths=None, count=16):
+        """Preprocessed batch for backend parity checks: the given images, else random noise images."""
+        images = [img for img in (self._load_image(p) for p in (image_paths or [])[:count]) if img is not None]
+        if not images:
+            import numpy as np
+            from PIL import Image as PILImage
+            rng = np.random.default_rng(0)
+            images = [PILImage.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(count)]
+        return self._preprocess(images)
+
+    def _load_default_model(self):
+        """
+        Default model, local first: the Models/.default snapshot, then the Hugging Face cache
+        (no network access), and only if neither exists, a download (then saved to Models/.default).
+        """
+        from transformers import pipeline
+        from huggingface_hub import snapshot_download
+
+        if os.path.isdir(DEFAULT_SNAPSHOT_DIR):
+            return pipeline("image-classification", model=DEFAULT_SNAPSHOT_DIR, device=self.device, trust_remote_code=True)
+
+        for local_only in (True, False):
+            for repo in DEFAULT_MODEL_REPOS:
+                try:
+                    path = snapshot_download(repo, local_files_only=local_only, allow_patterns=DEFAULT_MODEL_FILES)
+                    classifier = pipeline("image-classification", model=path, device=self.device, trust_remote_code=True)
+                except Exception:
+                    # Silent fallback
+                    continue
+
+                try:
+                    tmp_dir = DEFAULT_SNAPSHOT_DIR + ".tmp"
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    shutil.copytree(path, tmp_dir)
+                    os.replace(tmp_dir, DEFAULT_SNAPSHOT_DIR)
+                except Exception as e:
+                    print(f"Could not save default model snapshot: {e}")
+                return classifier
+        raise RuntimeError(f"None of the default models could be loaded: {DEFAULT_MODEL_REPOS}")
 
     def _load_model(self):
         """Loads the specified model pipeline."""
         try:
+            from transformers import pipeline
             if self.model_name == "default":
-                # Fallback / Default Legacy Model
-                try:
-                    return pipeline("image-classification", model="deepghs/anime_real_cls", device=self.device, trust_remote_code=True)
-                except Exception:
-                    # Silent fallback
-                    return pipeline("image-classification", model="google/vit-base-patch16-224", device=self.device)
+                return self._load_default_model()
             else:
                 # Custom Model from Models/ folder
                 model_path = os.path.join(self.base_model_path, self.model_name)
@@ -35,154 +256,578 @@ class ImageSorter:
                         model_path = "my_custom_model"
                     else:
                         raise FileNotFoundError(f"Model {self.model_name} not found in {self.base_model_path}")
+
+                from embeddings import is_linear_head, LinearHeadClassifier
+                if is_linear_head(model_path):
+                    return LinearHeadClassifier(model_path, device=self.device)
                 
                 return pipeline("image-classification", model=model_path, device=self.device)
         except Exception as e:
             print(f"Error loading model {self.model_name}: {e}")
             return None
 
-    def classify_image(self, image_path):
-        if not self.classifier:
-            return None
+    def _load_image(self, image_path, metrics=TOTALS):
+        """Opens an image as RGB, decoded at reduced size for large files (preprocessing then
+        costs about the same whatever the source resolution). Returns None if it can't be decoded.
+        metrics: the run's metrics.Metrics (timings outside a run only go to TOTALS)."""
+        from imaging import load_reduced
         try:
-            results = self.classifier(image_path)
-            # results is like [{'label': 'Manga', 'score': 0.99}, ...]
-            return results[0]['label']
+            with metrics.timer('decode'):
+                return load_reduced(image_path, self.decode_size, use_exif_thumbnail=self.exif_thumbnails)
         except Exception as e:
-            print(f"Error classifying {image_path}: {e}")
+            print(f"Error reading {image_path}: {e}")
             return None
 
-    def sort_directory(self, source_dir, mode='copy', progress_callback=None, manga_out=None, photo_out=None):
-        source_dir = os.path.abspath(source_dir)
-        files = [f for f in os.listdir(source_dir) if os.path.isfile(os.path.join(source_dir, f)) and f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp'))]
-        
+    def _preprocess(self, images):
+        return self.classifier.image_processor(images=images, return_tensors="pt")["pixel_values"]
+
+    def _forward(self, pixel_values):
+        """Runs the model on a preprocessed batch.
+        Returns a list of {'label', 'score', 'scores'} dicts, in the same order."""
+        import torch
+        model = self.classifier.model
+        pixel_values = pixel_values.to(self.classifier.device, dtype=model.dtype)
+        with torch.inference_mode():
+            logits = model(pixel_values=pixel_values).logits
+        return results_from_probs(logits.float().softmax(dim=-1), model.config.id2label)
+
+    def _predict(self, images):
+        """Preprocess + forward pass over a list of PIL images."""
+        if getattr(self.classifier, "image_processor", None) is None:
+            # Remote-code models may not expose a processor, let the pipeline batch itself
+            outputs = self.classifier(images, batch_size=len(images), top_k=len(self.classifier.model.config.id2label))
+            return [{'label': out[0]['label'], 'score': out[0]['score'], 'scores': {o['label']: round(o['score'], 5) for o in out}}
+                    for out in outputs]
+        return self._forward(self._preprocess(images))
+
+    def _prepare_batch(self, image_paths, metrics=TOTALS):
+        """
+        Decodes and preprocesses a batch of files (runs in the prefetch worker threads).
+        Files already in the cache (or, for linear-head models, in the embedding index)
+        are not decoded at all.
+        Decoded images are dropped once converted to pixel_values to keep memory bounded.
+        """
+        cached = {}
+        if self.cache:
+            for i, path in enumerate(image_paths):
+                hit = self.cache.get(path, self.model_name, self.model_version)
+                if hit:
+                    cached[i] = hit
+            metrics.count('cache_hits', len(cached))
+
+        rows, hashes = {}, {}
+        if self.embedding_index is not None:
+            for i, path in enumerate(image_paths):
+                if i not in cached:
+                    hashes[i] = self.embedding_index.hash_for(path)
+                    row = self.embedding_index.lookup([hashes[i]])[0]
+                    if row >= 0:
+                        rows[i] = row
+
+        images = [None if i in cached or i in rows else self._load_image(p, metrics) for i, p in enumerate(image_paths)]
+        batch = {'paths': image_paths, 'valid': [i for i, img in enumerate(images) if img is not None], 'images': None, 'pixel_values': None,
+                 'cached': cached, 'rows': rows, 'hashes': hashes}
+        if not batch['valid'] or not self.classifier:
+            return batch
+
+        if getattr(self.classifier, "image_processor", None) is None:
+            batch['images'] = [images[i] for i in batch['valid']]
+            return batch
+
+        try:
+            with metrics.timer('preprocess', len(batch['valid'])):
+                batch['pixel_values'] = self._preprocess([images[i] for i in batch['valid']])
+        except Exception:
+            # Isolate the image(s) the processor rejects
+            rows, valid = [], []
+            for i in batch['valid']:
+                try:
+                    rows.append(self._preprocess([images[i]]))
+                    valid.append(i)
+                except Exception as e:
+                    print(f"Error preprocessing {image_paths[i]}: {e}")
+            batch['valid'] = valid
+            import torch
+            batch['pixel_values'] = torch.cat(rows) if rows else None
+        return batch
+
+    def _infer_batch(self, batch, metrics=TOTALS):
+        """Runs inference on a prepared batch, returns one result (or None) per path."""
+        if not self.cascade:
+            return self._infer_model_batch(batch, metrics)
+        start = time.perf_counter()
+        results = self._infer_model_batch(batch, metrics)
+        # Cascade stats go to the run's metrics, so they are per run and merged from shard workers
+        metrics.observe('cascade_stage1', time.perf_counter() - start, sum(1 for r in results if r))
+        return self._escalate(batch['paths'], results, metrics)
+
+    @staticmethod
+    def margin(result):
+        """Gap between the two best scores of a result (small = the model hesitates)."""
+        scores = sorted((result.get('scores') or {}).values(), reverse=True)
+        second = scores[1] if len(scores) > 1 else 1.0 - result['score']
+        return result['score'] - second
+
+    def _escalate(self, paths, results, metrics=TOTALS):
+        """Second stage of the cascade: re-classifies the low-margin results with the cascade model."""
+        results = [dict(r, stage=1) if r else None for r in results]
+        hard = [i for i, r in enumerate(results) if r and self.margin(r) < self.cascade_margin]
+        if not hard:
+            return results
+        start = time.perf_counter()
+        second = []
+        loader = PrefetchLoader([paths[i] for i in hard], lambda paths: self.cascade._prepare_batch(paths, metrics),
+                                batch_size=self.cascade.batch_size, num_workers=self.num_workers, prefetch=2)
+        for batch in loader:
+            second.extend(self.cascade._infer_batch(batch, metrics))
+        metrics.observe('cascade_stage2', time.perf_counter() - start, len(hard))
+        for i, result in zip(hard, second):
+            if result:
+                results[i] = dict(result, stage=2)
+        metrics.count('cascade_escalated', sum(1 for i in hard if results[i]['stage'] == 2))
+        return results
+
+    def cascade_summary(self, report):
+        """Escalation rate and per-stage time of a run, from its metrics report()."""
+        stage1, stage2 = report['stages'].get('cascade_stage1'), report['stages'].get('cascade_stage2')
+        if not stage1 or not stage1['items']:
+            return ""
+        images, escalated = stage1['items'], report['counters'].get('cascade_escalated', 0)
+        return (f"Cascade : {escalated}/{images} images confiées à {self.cascade_name} ({escalated / images:.0%}) | "
+                f"étape 1 {1000 * stage1['total_s'] / images:.1f} ms/img | "
+                f"étape 2 {1000 * stage2['total_s'] / max(1, stage2['items']) if stage2 else 0.0:.1f} ms/img")
+
+    def _infer_model_batch(self, batch, metrics=TOTALS):
+        """Inference of this sorter's own model on a prepared batch."""
+        results = [batch['cached'].get(i) for i in range(len(batch['paths']))]
+        valid = batch['valid']
+        if self.embedding_index is not None:
+            return self._infer_head_batch(batch, results, metrics)
+        if not self.classifier or not valid:
+            return results
+
+        try:
+            with metrics.timer('inference', len(valid)):
+                if batch['pixel_values'] is not None:
+                    predictions = self._forward(batch['pixel_values'])
+                else:
+                    predictions = self._predict(batch['images'])
+        except Exception as e:
+            # One bad image fails the whole batch, retry one by one to isolate it
+            print(f"Batch failed ({e}), retrying image by image")
+            predictions = []
+            for j, i in enumerate(valid):
+                try:
+                    if batch['pixel_values'] is not None:
+                        predictions.append(self._forward(batch['pixel_values'][j:j + 1])[0])
+                    else:
+                        predictions.append(self._predict(batch['images'][j:j + 1])[0])
+                except Exception as e:
+                    print(f"Error classifying {batch['paths'][i]}: {e}")
+                    predictions.append(None)
+
+        startup.mark("first_classification")
+        for i, pred in zip(valid, predictions):
+            results[i] = pred
+            if pred and self.cache:
+                self.cache.put(batch['paths'][i], self.model_name, self.model_version, pred)
+        return results
+
+    def _infer_head_batch(self, batch, results, metrics=TOTALS):
+        """
+        Linear-head models: only images missing from the embedding index go through the
+        backbone (and are added to it), indexed ones are classified with a single matmul.
+        """
+        import torch
+        model = self.classifier.model
+        logits = {}
+        if batch['valid'] and batch['pixel_values'] is not None:
+            try:
+                with torch.inference_mode(), metrics.timer('inference', len(batch['valid'])):
+                    vectors = model.embed(batch['pixel_values'].to(self.classifier.device, dtype=model.dtype)).float()
+                    new_logits = model.head(vectors)
+                logits.update(zip(batch['valid'], new_logits))
+                stored = [(i, v) for i, v in zip(batch['valid'], vectors.cpu().numpy()) if batch['hashes'].get(i)]
+                if stored:
+                    self.embedding_index.add([batch['hashes'][i] for i, _ in stored], [v.astype('float16') for _, v in stored])
+            except Exception as e:
+                print(f"Error embedding batch: {e}")
+        if batch['rows']:
+            order = list(batch['rows'])
+            with metrics.timer('head', len(order)):
+                logits.update(zip(order, model.classify_vectors(self.embedding_index.vectors([batch['rows'][i] for i in order]))))
+
+        startup.mark("first_classification")
+        if not logits:
+            return results
+        order = list(logits)
+        probs = torch.stack([logits[i].float() for i in order]).softmax(dim=-1)
+        for i, result in zip(order, results_from_probs(probs, model.config.id2label)):
+            results[i] = result
+            if self.cache:
+                self.cache.put(batch['paths'][i], self.model_name, self.model_version, result)
+        return results
+
+    def classify_batch(self, image_paths):
+        """Classifies a list of files in a single batch.
+        Returns one result dict per path (None when the file could not be classified)."""
+        return self._infer_batch(self._prepare_batch(image_paths))
+
+    def classify_image(self, image_path, with_scores=False):
+        """Label of one image, or with_scores=True: its {'label', 'score', 'scores'} result."""
+        result = self.classify_batch([image_path])[0]
+        if with_scores:
+            return result
+        return result['label'] if result else None
+
+    def _destination_for(self, label, source_dir, manga_out=None, photo_out=None):
+        if self.model_name == "default" and (manga_out or photo_out):
+            if ("Manga" in label or "anime" in label) and manga_out:
+                return manga_out
+            elif ("Photo" in label or "real" in label) and photo_out:
+                return photo_out
+        return os.path.join(source_dir, label)
+
+    def _output_folders(self, source_dir, manga_out=None, photo_out=None, output_dir=None):
+        """Every folder a sort may write to, so a recursive scan skips them."""
+        folders = [manga_out, photo_out, output_dir, os.path.join(output_dir or source_dir, UNCERTAIN_FOLDER)]
+        folders += [os.path.join(output_dir or source_dir, label) for label in self.labels()]
+        return [f for f in folders if f]
+
+    def iter_sources(self, sources, recursive=False, manga_out=None, photo_out=None, output_dir=None):
+        """Streams (path, source_root) pairs for the images of several source folders."""
+        for source_dir in sources:
+            source_dir = os.path.abspath(source_dir)
+            exclude = self._output_folders(source_dir, manga_out, photo_out, output_dir)
+            for path in scan_images(source_dir, recursive=recursive, exclude=exclude):
+                yield path, source_dir
+
+    def _prepare_items(self, items, metrics=TOTALS):
+        batch = self._prepare_batch([path for path, _ in items], metrics)
+        batch['roots'] = [root for _, root in items]
+        return batch
+
+    def _dedup_items(self, items, max_distance=6):
+        """Splits (path, root) items into one item per duplicate group + {representative path: [duplicate items]}."""
+        from dedup import find_duplicates
+        groups = find_duplicates([path for path, _ in items], max_distance=max_distance, num_workers=self.num_workers)
+        duplicates = {}
+        dropped = set()
+        for group in groups:
+            duplicates[items[group[0]][0]] = [items[i] for i in group[1:]]
+            dropped.update(group[1:])
+        if groups:
+            print(f"Dedup: {len(dropped)} duplicates in {len(groups)} groups, {len(items) - len(dropped)} images to classify")
+        return [item for i, item in enumerate(items) if i not in dropped], duplicates
+
+    def sort_directory(self, source_dir, mode='copy', progress_callback=None, manga_out=None, photo_out=None, batch_size=None, num_workers=None, prefetch=None, recursive=False, output_dir=None, dry_run=False, on_result=None, journal=None, cancel=None, dedup=None, dedup_distance=6, threshold=None, metrics=None):
+        # Streamed: classification starts while the folder is still being listed
+        items = self.iter_sources([source_dir], recursive=recursive, manga_out=manga_out, photo_out=photo_out, output_dir=output_dir)
+        return self.sort_files(items, mode=mode, progress_callback=progress_callback, manga_out=manga_out, photo_out=photo_out,
+                               batch_size=batch_size, num_workers=num_workers, prefetch=prefetch, output_dir=output_dir,
+                               dry_run=dry_run, on_result=on_result, journal=journal, cancel=cancel,
+                               dedup=dedup, dedup_distance=dedup_distance, threshold=threshold, metrics=metrics)
+
+    def sort_files(self, items, mode='copy', progress_callback=None, manga_out=None, photo_out=None, batch_size=None, num_workers=None, prefetch=None, output_dir=None, dry_run=False, on_result=None, journal=None, cancel=None, dedup=None, dedup_distance=6, threshold=None, quiet=False, metrics=None, evict_cache=True):
+        """
+        Classifies and places a stream of (path, source_root) pairs.
+        Label folders are created in output_dir if given, else in each file's source_root,
+        keeping the file's sub-folder relative to source_root.
+        dry_run: classify only, nothing is copied or moved.
+        on_result(record) is called once per file, possibly from an I/O thread, with
+        {'path', 'label', 'score', 'scores', 'uncertain', 'stage', 'dest', 'status', 'error', 'duplicate_of'};
+        status is one of 'placed', 'dry_run', 'unclassified', 'duplicate', 'error'.
+        threshold: images whose top score is below it are placed in an '_uncertain' folder
+        (uncertain=True) instead of their label folder, e.g. for review or a bigger model.
+        journal: a SortJournal, files it already lists as placed are skipped (resume)
+        and every result is appended to it.
+        progress_callback(progress) is called after each batch with {'processed', 'skipped',
+        'elapsed', 'rate' (img/s), 'counts' (per label), 'recent' (last log lines)}.
+        cancel: a threading.Event, the sort stops cleanly after the current batch once set
+        (queued copies/moves complete, the journal stays open for a later resume).
+        dedup: group exact / near duplicates first (dedup.py, the whole file list is read
+        before sorting starts) and classify one image per group; the others reuse its label
+        and are placed normally ('reuse'), not placed ('skip', status 'duplicate') or placed
+        as hard links ('link', copy/reflink modes only).
+        quiet: no progress bar or end-of-run statistics on the console (watch mode, many small sorts).
+        metrics: a metrics.Metrics recording this run (its report() is the end-of-run report),
+        a new one if None. Each call has its own, so concurrent sorts don't mix their counters.
+        evict_cache=False skips the end-of-sort cache eviction, for callers running many small
+        sorts that call evict_cache() periodically instead (watch mode).
+        """
         from tqdm import tqdm
         
-        # print("Sorting started...") # Optional
-        
         results_log = []
+        recent = deque(maxlen=10)
+        counts = {}
+        processed = 0
+        skipped = 0
+        cancelled = False
+        start = time.perf_counter()
+        if metrics is None:
+            metrics = Metrics(parent=TOTALS)
+        items = metrics.timed_iter('scan', items)
+
+        if journal and not dry_run:
+            def pending(items):
+                nonlocal skipped
+                for path, root in items:
+                    if journal.is_done(path):
+                        skipped += 1
+                    else:
+                        yield path, root
+            items = pending(items)
+        else:
+            journal = None
+
+        duplicates = {}
+        if dedup:
+            items, duplicates = self._dedup_items(list(items), dedup_distance)
+
         # Use tqdm for progress bar in CMD
-        iterator = tqdm(files, desc="Sorting Images", unit="img")
+        iterator = tqdm(desc="Sorting Images", unit="img", disable=quiet)
+
+        if self.shard_pool:
+            # Worker processes classify chunks, placement stays here (one writer per folder)
+            loader = self.shard_pool
+            batches = self.shard_pool.imap(items, chunk_size=4 * (batch_size or self.batch_size), metrics=metrics)
+        else:
+            # Decoding/preprocessing runs in worker threads, overlapped with inference
+            loader = PrefetchLoader(
+                items,
+                lambda items: self._prepare_items(items, metrics),
+                batch_size=batch_size or self.batch_size,
+                num_workers=num_workers or self.num_workers,
+                prefetch=prefetch or self.prefetch,
+            )
+            batches = ((batch, self._infer_batch(batch, metrics)) for batch in loader)
         
-        for i, filename in enumerate(iterator):
-            filepath = os.path.join(source_dir, filename)
-            label = self.classify_image(filepath)
-            
-            if label:
-                # Determine destination
-                if self.model_name == "default" and (manga_out or photo_out):
-                    if ("Manga" in label or "anime" in label) and manga_out:
-                        dest_folder = manga_out
-                    elif ("Photo" in label or "real" in label) and photo_out:
-                        dest_folder = photo_out
-                    else:
-                        dest_folder = os.path.join(source_dir, label)
-                else:
-                    dest_folder = os.path.join(source_dir, label)
+        log_lock = threading.Lock()
 
-                if not os.path.exists(dest_folder):
-                    os.makedirs(dest_folder)
-                
-                dest_path = os.path.join(dest_folder, filename)
-                
-                try:
-                    if mode == 'move':
-                        shutil.move(filepath, dest_path)
-                    else:
-                        shutil.copy2(filepath, dest_path)
-                    results_log.append(f"{filename} -> {label}")
-                except Exception as e:
-                    print(f"Error moving/copying {filename}: {e}")
-                    results_log.append(f"Error {filename}: {e}")
+        def report(record):
+            filename = os.path.basename(record['path'])
+            with log_lock:
+                if record['status'] == 'error':
+                    print(f"Error moving/copying {filename}: {record['error']}")
+                    results_log.append(f"Error {filename}: {record['error']}")
+                elif record['status'] != 'unclassified':
+                    results_log.append(f"{filename} -> {record['label']}" + (" (incertain)" if record['uncertain'] else ""))
+                if record['status'] != 'unclassified':
+                    recent.append(results_log[-1])
+                if record['label']:
+                    key = UNCERTAIN_FOLDER if record['uncertain'] else record['label']
+                    counts[key] = counts.get(key, 0) + 1
+                if journal:
+                    journal.record(record, mode)
+                if on_result:
+                    on_result(record)
+
+        def on_placed(record, dst, error):
+            record.update(dest=dst, status='error' if error else 'placed', error=str(error) if error else None)
+            report(record)
+
+        def dispatch(placer, filepath, root, result, duplicate_of=None):
+            record = {'path': filepath, 'label': None, 'score': None, 'scores': None, 'uncertain': False, 'stage': None, 'dest': None,
+                      'status': 'unclassified', 'error': None, 'duplicate_of': duplicate_of}
+            if not result:
+                report(record)
+                return
+            record.update(label=result['label'], score=result['score'], scores=result.get('scores'), stage=result.get('stage'),
+                          uncertain=threshold is not None and result['score'] < threshold)
+            if duplicate_of and dedup == 'skip':
+                record.update(status='duplicate')
+                report(record)
+                return
+            if record['uncertain']:
+                dest_folder = os.path.join(output_dir or root, UNCERTAIN_FOLDER)
+            else:
+                dest_folder = self._destination_for(result['label'], output_dir or root, manga_out, photo_out)
+            # Keep the sub-folder structure when scanning recursively
+            rel_dir = os.path.relpath(os.path.dirname(filepath), root)
+            if rel_dir != os.curdir:
+                dest_folder = os.path.join(dest_folder, rel_dir)
+
+            if dry_run:
+                record.update(dest=os.path.join(dest_folder, os.path.basename(filepath)), status='dry_run')
+                report(record)
+            else:
+                placer.place(filepath, dest_folder, callback=lambda src, dst, error, record=record: on_placed(record, dst, error))
+
+        # Placement runs in its own I/O pool, inference doesn't wait for the disk
+        link_placer = FilePlacer(mode='hardlink', max_workers=self.io_workers, metrics=metrics) if dedup == 'link' and mode in ('copy', 'reflink') else None
+        try:
+            with FilePlacer(mode=mode, max_workers=self.io_workers, metrics=metrics) as placer:
+                for batch, results in batches:
+                    for filepath, root, result in zip(batch['paths'], batch['roots'], results):
+                        dispatch(placer, filepath, root, result)
+                        for dup_path, dup_root in duplicates.get(filepath, ()):
+                            if result and self.cache:
+                                self.cache.put(dup_path, self.model_name, self.model_version, result)
+                            dispatch(link_placer or placer, dup_path, dup_root, result, duplicate_of=filepath)
+                            processed += 1
+
+                    iterator.update(len(batch['paths']))
+                    processed += len(batch['paths'])
+                    metrics.count('images', len(batch['paths']))
+                    metrics.gauge('placement_queue', placer.pending)
+                    if hasattr(loader, 'queue_depth'):
+                        metrics.gauge('prefetch_queue', loader.queue_depth())
+                    if progress_callback:
+                        elapsed = time.perf_counter() - start
+                        with log_lock:
+                            progress_callback({'processed': processed, 'skipped': skipped, 'elapsed': elapsed,
+                                               'rate': processed / elapsed if elapsed else 0.0,
+                                               'counts': dict(counts), 'recent': list(recent)})
+                    if cancel is not None and cancel.is_set():
+                        cancelled = True
+                        break
+        finally:
+            # Stops the loader threads / drops the chunks still in flight
+            batches.close()
+            if link_placer:
+                link_placer.close()
+            if journal:
+                journal.flush()
+        iterator.close()
+        if journal and not cancelled:
+            journal.finish(processed=processed, skipped=skipped)
+        if self.cache:
+            self.cache.flush()
+        if evict_cache:
+            self.evict_cache()
+        run_report = metrics.report()
+        cascade = self.cascade_summary(run_report)
+        measures = metrics.summary(run_report)
+        if not quiet:
+            print(f"Pipeline: {loader.summary()}")
+            if self.cache:
+                print(f"Cache: {self.cache.hits} hits, {self.cache.misses} misses")
+            if cascade:
+                print(cascade)
+            print(measures)
             
-        return "\n".join(results_log[:20]) + ("\n..." if len(results_log) > 20 else "") + f"\n\nTraitement de {len(files)} images terminé."
+        done = f"Tri annulé après {processed} images (reprise possible)." if cancelled else f"Traitement de {processed} images terminé."
+        return "\n".join(results_log[:20]) + ("\n..." if len(results_log) > 20 else "") + f"\n\n{done}" + (f" ({skipped} déjà triées, reprise)" if skipped else "") + f"\n{loader.summary()}" + (f"\n{cascade}" if cascade else "") + f"\n{measures}"
+
+    def evict_cache(self):
+        """Trims the classification cache to its max_entries (in a worker when sharding)."""
+        if self.cache:
+            return self.cache.evict()
+        if self.shard_pool:
+            return self.shard_pool.evict_cache()
+        return 0
+
+    def _memmap_datasets(self, manifest, class_ids, processor, val_fraction=0.1, groups=None):
+        """Train/val datasets backed by a TensorStore, plus the batch-normalizing collator.
+        groups: duplicate groups (indices into manifest), each kept on one side of the split."""
+        import numpy as np
+        from tensor_store import TensorStore, MemmapImageDataset, NormalizeCollator
 
-    def train_model_multi(self, sources_list, epochs=3, batch_size=4):
+        size = processor.size
+        size = (size["height"], size["width"]) if "height" in size else (size["shortest_edge"], size["shortest_edge"])
+        store = TensorStore([p for p, _ in manifest], size=size, resample=processor.resample, num_workers=self.num_workers).build()
+        labels = [class_ids[c] for _, c in manifest]
+
+        indices = np.random.permutation(store.valid_indices())
+        n_val = int(len(indices) * val_fraction)
+        if groups and n_val:
+            from dedup import group_split
+            train_idx, val_idx = group_split(len(manifest), groups, val_fraction)
+            valid = set(indices.tolist())
+            train_idx = np.array([i for i in train_idx if i in valid])
+            val_idx = np.array([i for i in val_idx if i in valid])
+        elif n_val == 0:
+            # Not enough data for split? Use same for both (bad practice but avoids crash)
+            train_idx, val_idx = indices, indices
+        else:
+            train_idx, val_idx = indices[n_val:], indices[:n_val]
+
+        collate_fn = NormalizeCollator(processor.image_mean, processor.image_std)
+        return MemmapImageDataset(store, train_idx, labels), MemmapImageDataset(store, val_idx, labels), collate_fn
+
+    def train_model_multi(self, sources_list, epochs=3, batch_size=4, preprocess_cache=False, dataloader_workers=0, pin_memory=None, dedup=False, base_model='vit-base', precision='auto', grad_accum=1, freeze_layers=0, early_stopping_patience=3, evals_per_epoch=2, metrics=None, cancel=None):
         """
         sources_list: List of dicts [{'class_name': 'Manga', 'path': '/path/to/manga'}, ...]
         If class_name is empty/None, assumes path is a Root Dataset (contains subfolders).
+        preprocess_cache: decode/resize every image once into a uint8 memmap (tensor_store.py)
+        instead of decoding each image again on every epoch.
+        dedup: find exact / near duplicate images (dedup.py) and keep each group on one side
+        of the train/validation split, so validation isn't measured on training images.
+        base_model: a TRAIN_BASE_MODELS key (or any hub id), e.g. 'mobilenet' for a fast cascade first stage.
+        precision: a TRAIN_PRECISIONS value, mixed precision (bf16/fp16) on GPU by default.
+        grad_accum: gradient accumulation steps (effective batch = batch_size x grad_accum, same memory).
+        freeze_layers: lower backbone blocks left frozen, which speeds up training on small datasets.
+        Evaluation and checkpoints happen evals_per_epoch times per epoch, training stops after
+        early_stopping_patience evaluations without validation loss improvement (0: never)
+        and the best checkpoint is kept.
+        metrics: a metrics.Metrics recording the training steps, a new one if None.
+        cancel: a threading.Event, training stops after the current step once set and
+        nothing is saved (returns TRAINING_CANCELLED).
         """
         print(f"Starting training with sources: {sources_list}")
         
-        # Temp dir for aggregation
-        temp_dir = os.path.join(os.getcwd(), "temp_training_data")
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
-        
         try:
-            # 1. Aggregate Data
-            for source in sources_list:
-                path = source.get('path')
-                class_name = source.get('class_name')
-                
-                if not path or not os.path.exists(path):
-                    continue
-                
-                if class_name:
-                    # Explicit Class: Copy content of path to temp/class_name
-                    dst = os.path.join(temp_dir, class_name)
-                    os.makedirs(dst, exist_ok=True)
-                    
-                    # Copy images
-                    for item in os.listdir(path):
-                        s = os.path.join(path, item)
-                        if os.path.isfile(s) and s.lower().endswith(('.jpg', '.png', '.jpeg', '.webp')):
-                            shutil.copy2(s, os.path.join(dst, item))
-                    
-                    # Also check for subdirs? No, user said "Type dataset name" -> implies leaf folder.
-                    # But if they point to a folder that HAS subfolders, maybe we should warn? 
-                    # For now, let's assume leaf images.
-                    
-                else:
-                    # Root Dataset: Copy subfolders to temp/
-                    subdirs = [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
-                    for sub in subdirs:
-                        src = os.path.join(path, sub)
-                        dst = os.path.join(temp_dir, sub)
-                        if not os.path.exists(dst):
-                            shutil.copytree(src, dst)
-                        else:
-                            # Merge
-                            for item in os.listdir(src):
-                                s = os.path.join(src, item)
-                                d = os.path.join(dst, item)
-                                if os.path.isfile(s):
-                                    shutil.copy2(s, d)
+            import torch
+            from transformers import AutoModelForImageClassification, AutoImageProcessor, TrainingArguments, Trainer, TrainerCallback, EarlyStoppingCallback
+            from datasets import Dataset, Features, ClassLabel, Image
+
+            # 1. Collect (path, class) pairs, images are read in place
+            manifest = build_manifest(sources_list)
 
             # 2. Check Aggregation
-            classes = [d for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d))]
-            # Filter out empty classes
-            classes = [c for c in classes if len(os.listdir(os.path.join(temp_dir, c))) > 0]
+            classes = sorted({label for _, label in manifest})
             
             if len(classes) < 2:
                 return f"Erreur: Données insuffisantes pour l'entraînement.\nClasses trouvées : {classes}.\nIl faut au moins 2 catégories avec des images."
 
             # 3. Train
-            base_model = "google/vit-base-patch16-224-in21k"
+            base_model = TRAIN_BASE_MODELS.get(base_model, base_model)
             output_dir = os.path.join(os.getcwd(), "Models", self.model_name) if self.model_name != "default" else "my_custom_model"
             
-            dataset = load_dataset("imagefolder", data_dir=temp_dir, split="train")
-            try:
-                split = dataset.train_test_split(test_size=0.1)
-                train_ds = split['train']
-                val_ds = split['test']
-            except:
-                # Not enough data for split? Use same for both (bad practice but avoids crash)
-                train_ds = dataset
-                val_ds = dataset
-            
-            labels = train_ds.features['label'].names
+            class_ids = {c: i for i, c in enumerate(classes)}
+            labels = classes
             label2id = {label: str(i) for i, label in enumerate(labels)}
             id2label = {str(i): label for i, label in enumerate(labels)}
 
             processor = AutoImageProcessor.from_pretrained(base_model)
-            def transforms_fn(examples):
-                examples["pixel_values"] = [processor(img.convert("RGB"), return_tensors="pt")["pixel_values"][0] for img in examples["image"]]
-                return examples
-            
-            train_ds.set_transform(transforms_fn)
-            val_ds.set_transform(transforms_fn)
+
+            groups = None
+            if dedup:
+                from dedup import find_duplicates
+                groups = find_duplicates([p for p, _ in manifest], num_workers=self.num_workers)
+                print(f"Dedup: {sum(len(g) - 1 for g in groups)} duplicates in {len(groups)} groups")
+
+            if preprocess_cache and not all(hasattr(processor, a) for a in ("size", "resample", "image_mean", "image_std")):
+                print(f"{base_model} processor can't be used with the preprocessed cache, decoding images on the fly")
+                preprocess_cache = False
+
+            if preprocess_cache:
+                train_ds, val_ds, collate_fn = self._memmap_datasets(manifest, class_ids, processor, groups=groups)
+            else:
+                dataset = Dataset.from_dict(
+                    {"image": [p for p, _ in manifest], "label": [class_ids[c] for _, c in manifest]},
+                    features=Features({"image": Image(), "label": ClassLabel(names=classes)}),
+                )
+                try:
+                    if groups:
+                        from dedup import group_split
+                        train_idx, val_idx = group_split(len(dataset), groups, 0.1)
+                        if len(val_idx) == 0:
+                            raise ValueError("empty validation split")
+                        train_ds = dataset.select(train_idx)
+                        val_ds = dataset.select(val_idx)
+                    else:
+                        split = dataset.train_test_split(test_size=0.1)
+                        train_ds = split['train']
+                        val_ds = split['test']
+                except:
+                    # Not enough data for split? Use same for both (bad practice but avoids crash)
+                    train_ds = dataset
+                    val_ds = dataset
+
+                train_ds.set_transform(ProcessorTransform(processor))
+                val_ds.set_transform(ProcessorTransform(processor))
+                collate_fn = collate_examples
 
             model = AutoModelForImageClassification.from_pretrained(
                 base_model,
@@ -191,27 +836,66 @@ class ImageSorter:
                 label2id=label2id,
                 ignore_mismatched_sizes=True
             )
+            frozen = freeze_lower_layers(model, int(freeze_layers))
+            if frozen:
+                print(f"Training with the first {frozen} blocks of {base_model} frozen")
+
+            precision = resolve_precision(precision)
+            grad_accum = max(1, int(grad_accum))
+            # Evaluation / checkpoint cadence follows the dataset size
+            steps_per_epoch = math.ceil(len(train_ds) / (int(batch_size) * grad_accum * max(1, torch.cuda.device_count())))
+            eval_steps = max(1, steps_per_epoch // max(1, int(evals_per_epoch)))
+            print(f"Training: {precision}, effective batch {int(batch_size) * grad_accum}, evaluation every {eval_steps} steps")
 
             training_args = TrainingArguments(
                 output_dir=output_dir,
                 per_device_train_batch_size=int(batch_size),
+                gradient_accumulation_steps=grad_accum,
                 num_train_epochs=int(epochs),
                 remove_unused_columns=False,
-                eval_strategy="steps", # Change to steps if dataset small
+                eval_strategy="steps",
                 save_strategy="steps",
-                save_steps=100,
-                eval_steps=100,
+                save_steps=eval_steps,
+                eval_steps=eval_steps,
                 learning_rate=5e-5,
                 load_best_model_at_end=True,
+                metric_for_best_model="eval_loss",
+                greater_is_better=False,
                 save_total_limit=1,
-                use_cpu=False if torch.cuda.is_available() else True
+                bf16=precision == 'bf16',
+                fp16=precision == 'fp16',
+                use_cpu=False if torch.cuda.is_available() else True,
+                dataloader_num_workers=int(dataloader_workers),
+                dataloader_pin_memory=torch.cuda.is_available() if pin_memory is None else pin_memory,
+                dataloader_persistent_workers=int(dataloader_workers) > 0,
             )
 
-            def collate_fn(batch):
-                return {
-                    'pixel_values': torch.stack([x['pixel_values'] for x in batch]),
-                    'labels': torch.tensor([x['label'] for x in batch])
-                }
+            if metrics is None:
+                metrics = Metrics(parent=TOTALS)
+
+            class StepTimer(TrainerCallback):
+                """Times each training step as the 'train_step' stage."""
+                def on_step_begin(self, args, state, control, **kwargs):
+                    self.start = time.perf_counter()
+
+                def on_step_end(self, args, state, control, **kwargs):
+                    images = args.train_batch_size * args.gradient_accumulation_steps
+                    metrics.observe('train_step', time.perf_counter() - self.start, images)
+                    metrics.count('images', images)
+
+            def compute_metrics(eval_pred):
+                logits, label_ids = eval_pred
+                return {'accuracy': float((logits.argmax(-1) == label_ids).mean())}
+
+            class CancelCheck(TrainerCallback):
+                """Stops the training once `cancel` is set."""
+                def on_step_end(self, args, state, control, **kwargs):
+                    if cancel is not None and cancel.is_set():
+                        control.should_training_stop = True
+
+            callbacks = [StepTimer(), CancelCheck()]
+            if early_stopping_patience:
+                callbacks.append(EarlyStoppingCallback(early_stopping_patience=int(early_stopping_patience)))
 
             trainer = Trainer(
                 model=model,
@@ -220,26 +904,65 @@ class ImageSorter:
                 eval_dataset=val_ds,
                 tokenizer=processor,
                 data_collator=collate_fn,
+                compute_metrics=compute_metrics,
+                callbacks=callbacks,
             )
 
             trainer.train()
+            if cancel is not None and cancel.is_set():
+                print(f"Training of {self.model_name} cancelled, nothing saved")
+                return TRAINING_CANCELLED
+            # Validation accuracy of the kept (best) checkpoint
+            evals = [h for h in trainer.state.log_history if 'eval_loss' in h]
+            best = min(evals, key=lambda h: h['eval_loss']) if evals else {}
+            measures = metrics.summary()
+            print(measures)
             trainer.save_model(output_dir)
             processor.save_pretrained(output_dir)
-            
-            # Cleanup
+
+            # Previous results of this model are stale now
             try:
-                shutil.rmtree(temp_dir)
-            except: 
-                pass
+                ClassificationCache().invalidate_model(self.model_name)
+            except Exception as e:
+                print(f"Could not invalidate cache for {self.model_name}: {e}")
 
-            return f"Entraînement terminé ! Modèle '{self.model_name}' sauvegardé.\nClasses apprises : {', '.join(labels)}"
+            accuracy = f"\nPrécision en validation : {best['eval_accuracy']:.1%} (étape {best['step']})" if 'eval_accuracy' in best else ""
+            return f"Entraînement terminé ! Modèle '{self.model_name}' sauvegardé.\nClasses apprises : {', '.join(labels)}{accuracy}\n{measures}"
 
         except Exception as e:
             import traceback
             traceback.print_exc()
             return f"Echec: {e}"
 
+def build_manifest(sources_list):
+    """
+    Lists the training images as (path, class_name) pairs, without copying anything.
+    Sources with a class_name are leaf folders of images, sources without one are
+    root datasets where each subfolder is a class (merged across sources).
+    """
+    manifest = []
+    for source in sources_list:
+        path = source.get('path')
+        class_name = source.get('class_name')
+        
+        if not path or not os.path.exists(path):
+            continue
+        
+        if class_name:
+            manifest += [(p, class_name) for p in scan_images(path)]
+        else:
+            for sub in list_subdirs(path):
+                manifest += [(p, sub) for p in scan_images(os.path.join(path, sub), recursive=True)]
+    return manifest
+
 # Global wrapper
-def train_model(model_name, sources_list, epochs=3, batch_size=4):
-    s = ImageSorter(model_name=model_name)
-    return s.train_model_multi(sources_list, epochs, batch_size)
+def train_model(model_name, sources_list, epochs=3, batch_size=4, linear_head=False, **train_options):
+    if linear_head:
+        # Exact duplicates are always split-aware there, the backbone is fixed by the index
+        train_options.pop('dedup', None)
+        train_options.pop('base_model', None)
+        # Only a linear classifier on indexed backbone embeddings (embeddings.py)
+        from embeddings import train_linear_head
+        return train_linear_head(model_name, sources_list, cancel=train_options.get('cancel'))
+    s = ImageSorter(model_name=model_name, load_model=False)
+    return s.train_model_multi(sources_list, epochs, batch_size, **train_options)
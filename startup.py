@@ -0,0 +1,19 @@
+import time
+
+# Reference point: when this module is first imported (first line of app.py / cli.py)
+T0 = time.perf_counter()
+
+_marks = {}
+
+
+def mark(event):
+    """Records, once, the time elapsed since start-up for a milestone (time-to-UI, first classification...)."""
+    if event in _marks:
+        return _marks[event]
+    _marks[event] = time.perf_counter() - T0
+    print(f"[startup] {event}: {_marks[event]:.2f}s")
+    return _marks[event]
+
+
+def marks():
+    return dict(_marks)
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+DEFAULT_STORE_DIR = os.path.join(os.getcwd(), "Cache", "tensors")
+# Disk kept for stores of other file lists, least recently used ones are deleted beyond it
+DEFAULT_MAX_BYTES = 20 * 2**30
+
+
+class TensorStore:
+    """
+    Decoded + resized training images, stored once as a uint8 [N, H, W, 3] memmap.
+    The store is keyed by the file list (paths, sizes, mtimes) and the target size,
+    so later trainings on the same data reuse it instead of decoding again.
+    Uses ~150 KB of disk per 224x224 image; stores of other file lists are evicted (least
+    recently used first) once they take more than `max_bytes`.
+    """
+    def __init__(self, paths, size=(224, 224), resample=Image.BILINEAR, store_dir=DEFAULT_STORE_DIR, num_workers=8,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.paths = list(paths)
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.height, self.width = size
+        self.resample = resample
+        self.num_workers = num_workers
+        os.makedirs(store_dir, exist_ok=True)
+        key = self._key()
+        self.data_path = os.path.join(store_dir, f"{key}.u8")
+        self.meta_path = os.path.join(store_dir, f"{key}.json")
+        self.valid = None
+
+    def _key(self):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self.height}x{self.width}|{int(self.resample)}".encode())
+        for p in self.paths:
+            try:
+                st = os.stat(p)
+                h.update(f"{os.path.abspath(p)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+            except OSError:
+                h.update(f"{p}|missing\n".encode())
+        return h.hexdigest()
+
+    @property
+    def shape(self):
+        return (len(self.paths), self.height, self.width, 3)
+
+    def _decode_into(self, array, i):
+        try:
+            with Image.open(self.paths[i]) as img:
+                img.draft('RGB', (self.width, self.height))
+                img = img.convert("RGB").resize((self.width, self.height), self.resample)
+            array[i] = np.asarray(img, dtype=np.uint8)
+            return True
+        except Exception as e:
+            print(f"Error decoding {self.paths[i]}: {e}")
+            return False
+
+    def build(self):
+        """Decodes every image once (in parallel), or reuses an existing store."""
+        if os.path.exists(self.meta_path) and os.path.exists(self.data_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.valid = json.load(f)['valid']
+            print(f"Reusing preprocessed images: {self.data_path}")
+            os.utime(self.meta_path)   # Most recently used
+            self.evict()
+            return self
+
+        print(f"Preprocessing {len(self.paths)} images into {self.data_path}")
+        tmp_path = self.data_path + ".tmp"
+        array = np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=self.shape)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            self.valid = list(pool.map(lambda i: self._decode_into(array, i), range(len(self.paths))))
+        array.flush()
+        del array
+        os.replace(tmp_path, self.data_path)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'shape': self.shape, 'valid': self.valid}, f)
+        self.evict()
+        return self
+
+    def evict(self):
+        """Deletes the least recently used other stores beyond max_bytes. Returns how many."""
+        stores = []
+        for entry in os.scandir(self.store_dir):
+            key, ext = os.path.splitext(entry.name)
+            data_path = os.path.join(self.store_dir, f"{key}.u8")
+            if ext != ".json" or entry.path == self.meta_path or not os.path.exists(data_path):
+                continue
+            stores.append((entry.stat().st_mtime, entry.path, data_path, os.path.getsize(data_path)))
+        total = sum(size for *_, size in stores)
+        removed = 0
+        for _, meta_path, data_path, size in sorted(stores):
+            if total <= self.max_bytes:
+                break
+            try:
+                # The data goes first: a meta file alone is never taken for a store
+                os.remove(data_path)
+                os.remove(meta_path)
+            except OSError as e:
+                print(f"Could not delete {data_path}: {e}")   # e.g. still mapped by a running training on Windows
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            print(f"Removed {removed} old preprocessed image store(s) from {self.store_dir}")
+        return removed
+
+    def valid_indices(self):
+        return [i for i, ok in enumerate(self.valid) if ok]
+
+
+class MemmapImageDataset(torch.utils.data.Dataset):
+    """
+    Rows of a TensorStore + their labels. Batches are fetched with a single fancy-index
+    on the memmap (__getitems__), pixels stay uint8 until NormalizeCollator.
+    The memmap is opened lazily, so the dataset pickles cheaply to DataLoader workers.
+    """
+    def __init__(self, store, indices, labels):
+        self.data_path = store.data_path
+        self.shape = store.shape
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self._array = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.memmap(self.data_path, dtype=np.uint8, mode='r', shape=self.shape)
+        return self._array
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.__getitems__([i])
+
+    def __getitems__(self, batch_indices):
+        rows = self.indices[np.asarray(batch_indices)]
+        return {
+            'pixels': torch.from_numpy(np.ascontiguousarray(self.array[rows])),
+            'labels': torch.from_numpy(self.labels[rows]),
+        }
+
+
+class NormalizeCollator:
+    """uint8 NHWC batch -> normalized float NCHW pixel_values, in one vectorized op."""
+    def __init__(self, image_mean, image_std):
+        self.mean = torch.tensor(image_mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(image_std, dtype=torch.float32).view(1, 3, 1, 1)
+
+    def __call__(self, batch):
+        if isinstance(batch, list):
+            # DataLoader without __getitems__ support: one dict per sample
+            batch = {
+                'pixels': torch.cat([b['pixels'] for b in batch]),
+                'labels': torch.cat([b['labels'] for b in batch]),
+            }
+        pixels = batch['pixels'].permute(0, 3, 1, 2).float().div_(255)
+        return {'pixel_values': (pixels - self.mean) / self.std, 'labels': batch['labels']}
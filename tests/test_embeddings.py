@@ -0,0 +1,31 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embeddings import EmbeddingIndex
+
+
+def test_two_instances_do_not_share_rows(tmp_path):
+    first = EmbeddingIndex("backbone", dim=4, index_dir=str(tmp_path))
+    second = EmbeddingIndex("backbone", dim=4, index_dir=str(tmp_path))
+    rows_a = first.add(["a"], np.ones((1, 4)))
+    rows_b = second.add(["b"], np.full((1, 4), 2.0))
+    assert rows_a != rows_b
+    assert first.count == second.count == 2
+    assert first.vectors(rows_b).tolist() == [[2.0] * 4]
+    assert second.vectors(rows_a).tolist() == [[1.0] * 4]
+
+
+def test_hash_for_leaves_no_transaction_open(tmp_path):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"x")
+    first = EmbeddingIndex("backbone", dim=4, index_dir=str(tmp_path / "index"))
+    second = EmbeddingIndex("backbone", dim=4, index_dir=str(tmp_path / "index"))
+    first.hash_for(str(image))
+    assert not first._conn.in_transaction
+    second.add(["a"], np.ones((1, 4)))
+
+
+def test_vectors_of_an_empty_index(tmp_path):
+    index = EmbeddingIndex("backbone", dim=4, index_dir=str(tmp_path))
+    assert index.vectors([]).shape == (0, 4)
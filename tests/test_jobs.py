@@ -0,0 +1,68 @@
+import threading
+
+from jobs import JobScheduler
+
+
+def test_shared_job_is_cancelled_by_its_last_subscriber():
+    scheduler = JobScheduler(slots=1)
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        job.cancel.wait(5)
+        return "stopped"
+
+    owner = scheduler.submit('sort', 'default', work, key='same')
+    follower = scheduler.submit('sort', 'default', work, key='same')
+    assert follower is owner
+    assert started.wait(5)
+
+    assert not scheduler.release(follower.id)
+    assert not owner.cancel.is_set()
+    assert scheduler.release(owner.id)
+    assert owner.done.wait(5)
+    assert owner.status == 'cancelled'
+
+
+def test_different_key_is_a_different_job():
+    scheduler = JobScheduler(slots=1)
+    gate = threading.Event()
+    first = scheduler.submit('sort', 'default', lambda job: gate.wait(5), key=('a', 0.5))
+    second = scheduler.submit('sort', 'default', lambda job: gate.wait(5), key=('a', None))
+    assert first is not second
+    gate.set()
+
+
+def test_cancelled_job_is_not_joined():
+    scheduler = JobScheduler(slots=1)
+    started, finish = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        finish.wait(5)   # Still finishing its batch after the cancel
+
+    first = scheduler.submit('sort', 'default', work, key='same')
+    assert started.wait(5)
+    assert scheduler.release(first.id)
+    second = scheduler.submit('sort', 'default', lambda job: "ok", key='same')
+    assert second is not first
+    finish.set()
+    assert second.done.wait(5) and second.status == 'done'
+
+
+def test_job_completed_despite_cancel_stays_done():
+    scheduler = JobScheduler(slots=1)
+    started, finish = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        finish.wait(5)
+        job.cancelled = False   # Ignored the cancel, its work is complete
+        return "saved"
+
+    job = scheduler.submit('train', 'model', work)
+    assert started.wait(5)
+    assert scheduler.cancel(job.id)
+    finish.set()
+    assert job.done.wait(5)
+    assert (job.status, job.result) == ('done', "saved")
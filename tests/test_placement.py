@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from placement import FilePlacer
+
+
+def make_sources(tmp_path):
+    """Two source folders holding a different 'same.jpg' each."""
+    sources = []
+    for name in ("a", "b"):
+        folder = tmp_path / name
+        folder.mkdir()
+        (folder / "same.jpg").write_text(name)
+        sources.append(str(folder / "same.jpg"))
+    return sources
+
+
+@pytest.mark.parametrize("mode", ["move", "copy", "hardlink"])
+def test_same_name_is_never_overwritten(tmp_path, mode):
+    sources = make_sources(tmp_path)
+    out = tmp_path / "out"
+    placed = []
+    with FilePlacer(mode=mode) as placer:
+        for src in sources:
+            placer.place(src, str(out), callback=lambda src, dst, error: placed.append((src, dst, error)))
+
+    assert all(error is None for _, _, error in placed)
+    assert sorted(os.listdir(out)) == ["same (1).jpg", "same.jpg"]
+    assert sorted((out / name).read_text() for name in os.listdir(out)) == ["a", "b"]
+    # The callback gets the path actually used, so the journal can undo each move
+    for src, dst, _ in placed:
+        assert open(dst).read() == os.path.basename(os.path.dirname(src))
+    assert all(os.path.exists(src) == (mode != "move") for src in sources)
+
+
+def test_hardlink_already_in_place(tmp_path):
+    src = make_sources(tmp_path)[0]
+    out = tmp_path / "out"
+    for _ in range(2):
+        with FilePlacer(mode="hardlink") as placer:
+            placer.place(src, str(out))
+    assert os.listdir(out) == ["same.jpg"]
+
+
+@pytest.mark.parametrize("mode", ["copy", "reflink", "hardlink"])
+def test_rerun_places_nothing_twice(tmp_path, mode):
+    sources = make_sources(tmp_path)
+    out = tmp_path / "out"
+    for _ in range(3):
+        placed = []
+        with FilePlacer(mode=mode) as placer:
+            for src in sources:
+                placer.place(src, str(out), callback=lambda src, dst, error: placed.append(dst))
+        # Each source finds its own earlier copy, the name collision is kept apart
+        assert sorted(os.listdir(out)) == ["same (1).jpg", "same.jpg"]
+        assert sorted(open(dst).read() for dst in placed) == ["a", "b"]
+
+
+def test_different_file_with_same_size_and_mtime_is_not_skipped(tmp_path):
+    src = make_sources(tmp_path)[0]
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "same.jpg").write_text("z")
+    st = os.stat(src)
+    os.utime(out / "same.jpg", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with FilePlacer(mode="copy") as placer:
+        placer.place(src, str(out))
+    assert sorted(os.listdir(out)) == ["same (1).jpg", "same.jpg"]
+
+
+def make_sorter():
+    from sorter import ImageSorter
+
+    # Sorter without a model: every image is labelled 'A'
+    sorter = object.__new__(ImageSorter)
+    sorter.__dict__.update(model_name="fake", model_version="v", batch_size=4, num_workers=1, prefetch=1, io_workers=2,
+                           cache=None, cascade=None, shard_pool=None, embedding_index=None)
+    sorter.labels = lambda: ["A"]
+    sorter._prepare_batch = lambda paths, metrics=None: {'paths': paths, 'valid': list(range(len(paths))), 'cached': {}}
+    sorter._infer_batch = lambda batch, metrics=None: [{'label': "A", 'score': 1.0} for _ in batch['paths']]
+    return sorter
+
+
+def test_rerun_copy_sort(tmp_path):
+    pytest.importorskip("tqdm")
+    sorter = make_sorter()
+    sources = make_sources(tmp_path)
+    out = tmp_path / "out"
+    for _ in range(2):
+        sorter.sort_files([(src, os.path.dirname(src)) for src in sources], mode="copy", output_dir=str(out), quiet=True)
+    assert sorted(os.listdir(out / "A")) == ["same (1).jpg", "same.jpg"]
+
+
+def test_sort_two_sources_sharing_a_filename(tmp_path):
+    pytest.importorskip("tqdm")
+    sorter = make_sorter()
+    sources = make_sources(tmp_path)
+    out = tmp_path / "out"
+    records = []
+    sorter.sort_files([(src, os.path.dirname(src)) for src in sources], mode="move", output_dir=str(out),
+                      on_result=records.append, quiet=True)
+
+    assert sorted(os.listdir(out / "A")) == ["same (1).jpg", "same.jpg"]
+    assert sorted((out / "A" / name).read_text() for name in os.listdir(out / "A")) == ["a", "b"]
+    assert len({record['dest'] for record in records}) == 2
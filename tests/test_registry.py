@@ -0,0 +1,22 @@
+from registry import ModelRegistry
+
+
+def test_cascade_reuses_the_loaded_big_model():
+    loads = []
+
+    def factory(key, cascade=None):
+        loads.append(key)
+        return {'key': key, 'cascade': cascade}
+
+    registry = ModelRegistry(factory, dependencies=lambda key: key.split(">")[1:])
+    big = registry.get("big")
+    cascade = registry.get("small>big")
+    assert cascade['cascade'] is big
+    assert loads == ["big", "small>big"]
+
+
+def test_dependency_loaded_first_without_deadlock():
+    registry = ModelRegistry(lambda key, *deps: (key, deps), dependencies=lambda key: key.split(">")[1:])
+    key, (big,) = registry.get("small>big")
+    assert big == ("big", ())
+    assert registry.loaded() == ["big", "small>big"]
@@ -0,0 +1,253 @@
+import os
+import queue
+import threading
+import time
+
+from scanner import IMAGE_EXTENSIONS, scan_images
+
+# How often sorted files that left the inbox (moved, deleted) are forgotten and the
+# classification cache is trimmed, in seconds
+PRUNE_INTERVAL = 60.0
+
+
+class FolderWatcher:
+    """
+    Long-running inbox sorting: new images in `folders` are picked up from filesystem
+    events (watchdog: inotify / ReadDirectoryChangesW / FSEvents) or, without watchdog,
+    by polling the folder listing every `poll_interval` seconds. The model stays loaded.
+
+    A file is sorted once it is fully written: closed by the writer (inotify close event)
+    or, otherwise, unchanged (size, mtime) for `settle` seconds and readable. Files ready
+    within `window` seconds of each other are sorted together (batched inference), through
+    ImageSorter.sort_files, so they are placed like in any other sort. A batch whose sort
+    fails is retried after `retry_delay` seconds, doubling up to `max_retries` attempts.
+    Other keyword arguments (mode, output_dir, threshold, on_result...) go to sort_files.
+    """
+    def __init__(self, sorter, folders, recursive=False, settle=0.3, window=0.1, poll_interval=1.0, max_batch=None,
+                 include_existing=True, use_events=True, retry_delay=1.0, max_retries=5, **sort_options):
+        self.sorter = sorter
+        self.roots = [os.path.abspath(f) for f in folders]
+        self.recursive = recursive
+        self.settle = settle
+        self.window = window
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch or 4 * sorter.batch_size
+        self.include_existing = include_existing
+        self.use_events = use_events
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.sort_options = sort_options
+        # Label folders are often inside the inbox: their new files must not be sorted again
+        self.exclude = [os.path.normcase(os.path.abspath(f)) for root in self.roots
+                        for f in sorter._output_folders(root, sort_options.get('manga_out'), sort_options.get('photo_out'), sort_options.get('output_dir'))]
+        self.events = queue.Queue()
+        self.pending = {}   # path -> [size, mtime, last change, closed, first seen]
+        self.done = {}      # path -> (size, mtime) when it was sorted, for files still in the inbox
+        self.retries = {}   # path -> (failed attempts, next attempt time)
+        self.stats = {'sorted': 0, 'batches': 0, 'max_latency': 0.0}
+
+    def _root_of(self, path):
+        """Watched folder containing path, None for ignored files (not an image, output folder, sub-folder when not recursive)."""
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+        folder = os.path.normcase(os.path.dirname(path))
+        if any(folder == f or folder.startswith(f + os.sep) for f in self.exclude):
+            return None
+        for root in self.roots:
+            norm = os.path.normcase(root)
+            if folder == norm or (self.recursive and folder.startswith(norm + os.sep)):
+                return root
+        return None
+
+    def _start_observer(self):
+        """watchdog observer feeding self.events, None if watchdog isn't installed."""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog not installed, polling the folder every "
+                  f"{self.poll_interval}s (pip install watchdog for event-driven watching)")
+            return None
+        events = self.events
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory or event.event_type == 'deleted':
+                    return
+                # Renamed into place (e.g. upload.tmp -> photo.jpg): the new name counts
+                path = getattr(event, 'dest_path', None) or event.src_path
+                events.put((os.fsdecode(path), event.event_type == 'closed'))
+
+        observer = Observer()
+        for root in self.roots:
+            observer.schedule(Handler(), root, recursive=self.recursive)
+        observer.start()
+        return observer
+
+    def _poll(self):
+        """Polling fallback: queues the files that are new or changed since the last listing."""
+        for root in self.roots:
+            for path in scan_images(root, recursive=self.recursive, exclude=self.exclude):
+                if path in self.pending:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if self.done.get(path) != (st.st_size, st.st_mtime):
+                    self.events.put((path, False))
+
+    def _note(self, path, closed, now):
+        if self._root_of(path) is None:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)   # Deleted / moved away again
+            return
+        if self.done.get(path) == (st.st_size, st.st_mtime):
+            return   # Already sorted (copy mode leaves the source in place)
+        entry = self.pending.get(path)
+        if entry is None:
+            self.pending[path] = [st.st_size, st.st_mtime, now, closed, now]
+        else:
+            if (entry[0], entry[1]) != (st.st_size, st.st_mtime):
+                entry[0], entry[1], entry[2] = st.st_size, st.st_mtime, now
+            entry[3] = entry[3] or closed
+
+    def _drain(self, timeout):
+        """Applies the queued events, waiting up to `timeout` seconds for the first one."""
+        try:
+            path, closed = self.events.get(timeout=timeout) if timeout > 0 else self.events.get_nowait()
+        except queue.Empty:
+            return
+        now = time.monotonic()
+        self._note(path, closed, now)
+        while True:
+            try:
+                path, closed = self.events.get_nowait()
+            except queue.Empty:
+                return
+            self._note(path, closed, now)
+
+    @staticmethod
+    def _readable(path):
+        # Windows: a file still open for writing can't be opened (sharing violation)
+        try:
+            with open(path, 'rb'):
+                return True
+        except OSError:
+            return False
+
+    def _ready(self, now):
+        """Pending files that are fully written (and not waiting for a retry)."""
+        ready = []
+        for path, entry in list(self.pending.items()):
+            if path in self.retries and self.retries[path][1] > now:
+                continue
+            if not entry[3]:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del self.pending[path]
+                    self.retries.pop(path, None)
+                    continue
+                if (entry[0], entry[1]) != (st.st_size, st.st_mtime):
+                    entry[0], entry[1], entry[2] = st.st_size, st.st_mtime, now
+                    continue
+                if now - entry[2] < self.settle or not entry[0] or not self._readable(path):
+                    continue
+            ready.append(path)
+        return ready
+
+    def _sort(self, paths):
+        entries = {path: self.pending.pop(path) for path in paths}
+        try:
+            # Cache eviction scans the whole cache: done every PRUNE_INTERVAL, not per batch
+            self.sorter.sort_files([(path, self._root_of(path)) for path in paths], quiet=True, evict_cache=False, **self.sort_options)
+            failed = None
+        except Exception as e:
+            failed = e
+        now = time.monotonic()
+        if failed:
+            self._retry(entries, failed, now)
+            return
+        for path, entry in entries.items():
+            self.retries.pop(path, None)
+            # Moved files are gone, only those left in place (copy modes) must not be sorted again
+            if os.path.exists(path):
+                self.done[path] = (entry[0], entry[1])
+        latency = now - min(entry[4] for entry in entries.values())
+        self.stats['sorted'] += len(paths)
+        self.stats['batches'] += 1
+        self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+        print(f"Watch: {len(paths)} image(s) sorted, {latency:.2f}s after arrival ({self.stats['sorted']} in total)")
+
+    def _retry(self, entries, error, now):
+        """Queues the files of a failed batch again, with exponential backoff."""
+        retried = given_up = 0
+        for path, entry in entries.items():
+            if not os.path.exists(path):
+                self.retries.pop(path, None)   # Placed before the failure, or removed
+                continue
+            attempts = self.retries.get(path, (0, 0.0))[0] + 1
+            if attempts > self.max_retries:
+                # Given up: only sorted again if it changes
+                self.retries.pop(path, None)
+                self.done[path] = (entry[0], entry[1])
+                given_up += 1
+                continue
+            self.retries[path] = (attempts, now + self.retry_delay * 2 ** (attempts - 1))
+            self.pending[path] = entry
+            retried += 1
+        print(f"Watch: sorting {len(entries)} image(s) failed: {error} "
+              f"({retried} to retry" + (f", {given_up} given up after {self.max_retries} attempts)" if given_up else ")"))
+
+    def _prune(self):
+        """Forgets sorted files that are no longer in the inbox (moved, deleted, changed)."""
+        for path, stamp in list(self.done.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.done[path]
+                continue
+            if (st.st_size, st.st_mtime) != stamp:
+                del self.done[path]
+
+    def run(self, stop=None):
+        """Watches until `stop` (a threading.Event) is set or Ctrl+C. Returns the stats."""
+        stop = stop or threading.Event()
+        if self.include_existing:
+            self._poll()
+        observer = self._start_observer() if self.use_events else None
+        next_poll = time.monotonic() + self.poll_interval
+        next_prune = time.monotonic() + PRUNE_INTERVAL
+        print(f"Watching {', '.join(self.roots)} (Ctrl+C to stop)")
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                if observer is None and now >= next_poll:
+                    self._poll()
+                    next_poll = now + self.poll_interval
+                if now >= next_prune:
+                    self._prune()
+                    self.sorter.evict_cache()
+                    next_prune = now + PRUNE_INTERVAL
+                # Short ticks while files are settling, otherwise sleep on the event queue
+                self._drain(min(self.settle / 3, 0.05) if self.pending else 0.5 if observer else max(0.0, next_poll - now))
+                ready = self._ready(time.monotonic())
+                if not ready:
+                    continue
+                # Micro-batch: give files arriving together a moment to join the batch
+                deadline = time.monotonic() + self.window
+                while len(ready) < self.max_batch and time.monotonic() < deadline:
+                    self._drain(deadline - time.monotonic())
+                    ready = self._ready(time.monotonic())
+                self._sort(ready[:self.max_batch])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        return self.stats